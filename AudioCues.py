@@ -0,0 +1,217 @@
+"""
+Sound cues for buzz-ins and answers, played straight from controller events.
+
+Every cue is loaded and decoded into memory when AudioCues is created, the mixer runs
+with a small buffer and a fixed pool of channels, so starting a cue is a copy into the
+mixer and never a file read. Cues bound to buttons (bind) play from the event listener,
+on the reader thread, without waiting for the game loop to get round to them.
+
+A cue is sounds/<name>.wav (or .ogg) next to this file if there is one, otherwise a
+tone made up the first time the cues load and kept in .tones/ for the next start.
+
+Environment:
+  BUZZ_AUDIO=0            no sound
+  BUZZ_AUDIO_BUFFER=n     mixer buffer in samples (default 256, smaller is sooner but may crackle)
+  SDL_AUDIODRIVER=dummy   mix into nothing, for running without a sound card
+"""
+import collections
+import hashlib
+import math
+import os
+import threading
+import time
+import traceback
+from array import array
+
+import Metrics
+
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+SOUNDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sounds")
+# Tones already made, so making them in Python doesn't slow every start down
+TONES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tones")
+
+# name: (frequencies in Hz, played one after another, seconds each)
+TONES = {
+    "buzz": ((880,), 0.15),
+    "correct": ((660, 880, 1320), 0.09),
+    "wrong": ((196, 147), 0.2),
+    "tick": ((1760,), 0.03),
+    "tie": ((988, 988), 0.07),
+}
+
+FREQUENCY = 44100
+CHANNELS = 2
+BUFFER = 256
+POOL_SIZE = 8
+
+PLAY_LATENCY = Metrics.histogram("audio.event_to_play")
+CUES_PLAYED = Metrics.counter("audio.cues")
+
+
+def tone(frequencies, seconds, frequency=FREQUENCY, channels=CHANNELS, volume=0.4):
+    """16-bit PCM of each frequency in turn, with a short fade at both ends so it doesn't click."""
+    samples = array("h")
+    length = int(seconds * frequency)
+    fade = min(length // 4, int(0.005 * frequency))
+    for hz in frequencies:
+        step = 2 * math.pi * hz / frequency
+        for n in range(length):
+            level = min(1.0, n / fade, (length - n) / fade) if fade else 1.0
+            value = int(32767 * volume * level * math.sin(step * n))
+            samples.extend([value] * channels)
+    return samples.tobytes()
+
+
+def cached_tone(name, frequencies, seconds, frequency=FREQUENCY, channels=CHANNELS):
+    """tone(), read from TONES_DIR if it has been made with these settings before, saved there if not."""
+    key = hashlib.sha1(repr((frequencies, seconds, frequency, channels)).encode()).hexdigest()[:12]
+    path = os.path.join(TONES_DIR, "%s-%s.pcm" % (name, key))
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        pass
+    pcm = tone(frequencies, seconds, frequency, channels)
+    try:
+        os.makedirs(TONES_DIR, exist_ok=True)
+        # Written aside and moved into place, so a half written tone is never read
+        with open(path + ".tmp", "wb") as f:
+            f.write(pcm)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        # Somewhere read only, it gets made again next time
+        pass
+    return pcm
+
+
+class AudioCues:
+    """
+    The cues, the mixer and the channel pool.
+
+        cues = AudioCues()
+        cues.bind(buzz, {"red": "buzz"})     # every red press beeps, from the reader thread
+        cues.play("correct")
+
+    If sound can't be used (no pygame, no audio device, BUZZ_AUDIO=0) it is created
+    disabled and every call does nothing.
+    """
+
+    # How many latencies are kept
+    LATENCY_SAMPLES = 10000
+
+    def __init__(self, names=None, buffer=None, pool_size=POOL_SIZE):
+        self.enabled = False
+        self.sounds = {}
+        self.buffer = buffer or int(os.environ.get("BUZZ_AUDIO_BUFFER", BUFFER))
+        self.frequency = FREQUENCY
+        # Time from each recent event to its cue being handed to the mixer, in nanoseconds
+        self.latencies_ns = collections.deque(maxlen=self.LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+        self._channels = []
+        self._next_channel = 0
+        self._bindings = []
+
+        if pygame is None or os.environ.get("BUZZ_AUDIO") == "0":
+            return
+        try:
+            self._open_mixer(pool_size)
+        except pygame.error as e:
+            print("No sound: " + str(e))
+            return
+        self._channels = [pygame.mixer.Channel(i) for i in range(pool_size)]
+        for name in (names or TONES):
+            self.sounds[name] = self._load(name)
+        self.enabled = True
+
+    def _open_mixer(self, pool_size):
+        # The buffer can only be set when the mixer opens, so reopen it if pygame.init() already has
+        if pygame.mixer.get_init():
+            pygame.mixer.quit()
+        pygame.mixer.init(FREQUENCY, -16, CHANNELS, self.buffer)
+        self.frequency, _, self.mixer_channels = pygame.mixer.get_init()
+        pygame.mixer.set_num_channels(pool_size)
+
+    def _load(self, name):
+        for ext in (".wav", ".ogg"):
+            path = os.path.join(SOUNDS_DIR, name + ext)
+            if os.path.exists(path):
+                return pygame.mixer.Sound(path)
+        frequencies, seconds = TONES.get(name, ((440,), 0.1))
+        return pygame.mixer.Sound(buffer=cached_tone(name, frequencies, seconds, self.frequency, self.mixer_channels))
+
+    @property
+    def output_latency_ms(self):
+        """How long a cue can wait in the mixer buffer before it is heard, on top of the measured latency."""
+        return 1000.0 * self.buffer / self.frequency
+
+    def close(self):
+        for buzz, listener in self._bindings:
+            buzz.remove_listener(listener)
+        self._bindings = []
+        if self.enabled:
+            pygame.mixer.stop()
+            self.enabled = False
+
+    # -----------------------------
+    # PLAYING
+    # -----------------------------
+
+    def play(self, name, event=None):
+        """
+        Start a cue on the next channel in the pool, cutting off the oldest cue if they are all busy.
+        Given the event that caused it, the time from the event to now is recorded.
+        """
+        if not self.enabled:
+            return False
+        sound = self.sounds.get(name)
+        if sound is None:
+            return False
+        with self._lock:
+            channel = self._free_channel()
+            channel.play(sound)
+        if event is not None:
+            latency = time.monotonic_ns() - event.timestamp_ns
+            self.latencies_ns.append(latency)
+            if Metrics.ENABLED:
+                PLAY_LATENCY.record(latency)
+        if Metrics.ENABLED:
+            CUES_PLAYED.add()
+        return True
+
+    def _free_channel(self):
+        for _ in range(len(self._channels)):
+            channel = self._channels[self._next_channel]
+            self._next_channel = (self._next_channel + 1) % len(self._channels)
+            if not channel.get_busy():
+                return channel
+        # All busy: the round robin has come back to the one started longest ago
+        channel = self._channels[self._next_channel]
+        self._next_channel = (self._next_channel + 1) % len(self._channels)
+        return channel
+
+    def bind(self, buzz, cues, controllers=None):
+        """
+        Play a cue on every press of a button, from buzz's event listener:
+        cues is {button: cue name}. Returns the listener, for unbind.
+        """
+        def listener(event):
+            if event.pressed and (controllers is None or event.controller in controllers):
+                name = cues.get(event.button)
+                if name is not None:
+                    try:
+                        self.play(name, event)
+                    except pygame.error:
+                        traceback.print_exc()
+
+        if self.enabled:
+            buzz.add_listener(listener)
+            self._bindings.append((buzz, listener))
+        return listener
+
+    def unbind(self, buzz, listener):
+        buzz.remove_listener(listener)
+        self._bindings = [(b, l) for b, l in self._bindings if l is not listener]
@@ -0,0 +1,82 @@
+import random
+from collections import namedtuple
+
+# winner: controller that gets to answer
+# ranking: every controller that buzzed, best first
+# events: the press event behind each entry in ranking
+# tied: controllers that were within the tie window of the first press (winner included)
+BuzzResult = namedtuple("BuzzResult", ["winner", "ranking", "events", "tied"])
+
+
+class BuzzArbiter:
+    """
+    Decides who buzzed first from press events, by report timestamp and then report
+    sequence number, instead of by controller number.
+    Presses within tie_window_ms of each other (or in the same report) are a tie, settled by tie_break:
+      - "random": a fair coin
+      - "lowest": the lowest numbered controller, like the old behaviour
+      - a function taking the tied events and returning them in winning order
+    """
+
+    def __init__(self, button="red", controllers=(0, 1, 2, 3), tie_window_ms=0.0, tie_break="random", rng=None):
+        self.button = button
+        self.controllers = controllers
+        self.tie_window_ns = int(tie_window_ms * 1000000)
+        self.tie_break = tie_break
+        self.rng = rng if rng is not None else random.Random()
+        self.reset()
+
+    def reset(self):
+        self._first = {}   # controller -> first press event
+
+    def offer(self, event):
+        """Consider an event; only the first press of the button per controller counts. Returns True if used."""
+        if (not event.pressed or event.button != self.button or
+                event.controller not in self.controllers or event.controller in self._first):
+            return False
+        self._first[event.controller] = event
+        return True
+
+    def has_presses(self):
+        return bool(self._first)
+
+    def first_press_ns(self):
+        return min(event.timestamp_ns for event in self._first.values())
+
+    def window_closes_ns(self):
+        """When presses stop counting as a tie with the earliest one so far."""
+        return self.first_press_ns() + self.tie_window_ns
+
+    def _ordered(self, events):
+        if self.tie_break == "random":
+            events = list(events)
+            self.rng.shuffle(events)
+            return events
+        if self.tie_break == "lowest":
+            return sorted(events, key=lambda event: event.controller)
+        return list(self.tie_break(list(events)))
+
+    def groups(self):
+        """Presses in arrival order, split into groups of ties."""
+        events = sorted(self._first.values(), key=lambda event: (event.timestamp_ns, event.seq))
+        groups = []
+        for event in events:
+            if groups:
+                start = groups[-1][0]
+                if event.seq == start.seq or event.timestamp_ns - start.timestamp_ns <= self.tie_window_ns:
+                    groups[-1].append(event)
+                    continue
+            groups.append([event])
+        return groups
+
+    def decide(self):
+        """The ranked result, or None if nobody has buzzed."""
+        groups = self.groups()
+        if not groups:
+            return None
+        events = []
+        for group in groups:
+            events.extend(self._ordered(group) if len(group) > 1 else group)
+        ranking = [event.controller for event in events]
+        tied = sorted(event.controller for event in groups[0])
+        return BuzzResult(ranking[0], ranking, events, tied)
@@ -0,0 +1,200 @@
+import asyncio
+import time
+
+from BuzzArbiter import BuzzArbiter
+from BuzzController import BuzzController, BUTTON_BITS, ButtonEvent
+
+
+class AsyncBuzzController:
+    """
+    asyncio front end for a BuzzController.
+    Events come from the controller's reader thread and are handed to the event loop,
+    so input, timers and rendering can all share one loop without busy waiting.
+
+        async with AsyncBuzzController() as buzz:
+            async for event in buzz.events():
+                ...
+            winner = await buzz.first_pressed("red", [0, 1, 2, 3], timeout=10)
+    """
+
+    # Events kept per subscriber before the oldest are dropped
+    QUEUE_SIZE = 256
+
+    def __init__(self, buzz=None):
+        self.buzz = buzz if buzz is not None else BuzzController()
+        self._loop = None
+        self._subscribers = set()
+        # Events a buzz-in read past the end of its window, for whoever subscribes next
+        self._held = []
+        self._lights_task = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def start(self):
+        """Start passing events to the running loop."""
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self.buzz.start_reader()
+        self.buzz.add_listener(self._on_event)
+
+    def close(self):
+        self.buzz.remove_listener(self._on_event)
+        if self._lights_task is not None:
+            self._lights_task.cancel()
+            self._lights_task = None
+        self.buzz.close()
+        self._loop = None
+
+    # -----------------------------
+    # EVENTS
+    # -----------------------------
+
+    def _on_event(self, event):
+        # Runs on the reader thread
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event):
+        for subscriber in self._subscribers:
+            if subscriber.full():
+                subscriber.get_nowait()
+            subscriber.put_nowait(event)
+
+    def _subscribe(self):
+        if self._loop is None:
+            self.start()
+        subscriber = asyncio.Queue(self.QUEUE_SIZE)
+        for event in self._held:
+            subscriber.put_nowait(event)
+        self._held = []
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    async def events(self):
+        """Every press and release from now on."""
+        subscriber = self._subscribe()
+        try:
+            while True:
+                yield await subscriber.get()
+        finally:
+            self._subscribers.discard(subscriber)
+
+    async def wait_for_press(self, controllers=None, buttons=None, timeout=None):
+        """The next press on one of the controllers (every player by default, and buttons), or None on timeout."""
+        if controllers is None:
+            controllers = range(self.buzz.num_players)
+        subscriber = self._subscribe()
+        try:
+            return await self._next_press(subscriber, controllers, buttons, timeout)
+        finally:
+            self._subscribers.discard(subscriber)
+
+    async def _next_press(self, subscriber, controllers, buttons, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                event = await asyncio.wait_for(subscriber.get(), remaining)
+            except asyncio.TimeoutError:
+                return None
+            if event.pressed and event.controller in controllers and (buttons is None or event.button in buttons):
+                return event
+
+    async def buzz_in(self, buzzButton="red", controllers=None, timeout=None, arbiter=None,
+                      rank_window_ms=0):
+        """Async version of BuzzController.buzz_in, returns a BuzzResult or None on timeout."""
+        if controllers is None:
+            controllers = range(self.buzz.num_players)
+        if arbiter is None:
+            arbiter = BuzzArbiter(buzzButton, controllers)
+        subscriber = self._subscribe()
+        try:
+            # Players already holding the button down are tied with each other
+            bits = self.buzz.get_state().bits
+            now = time.monotonic_ns()
+            for i in controllers:
+                if bits & BUTTON_BITS[(i, buzzButton)]:
+                    arbiter.offer(ButtonEvent(now, 0, i, buzzButton, True))
+
+            if not arbiter.has_presses():
+                event = await self._next_press(subscriber, controllers, (buzzButton,), timeout)
+                if event is None:
+                    return None
+                arbiter.offer(event)
+
+            closes = max(arbiter.window_closes_ns(), arbiter.first_press_ns() + int(rank_window_ms * 1000000))
+            while True:
+                remaining = (closes - time.monotonic_ns()) / 1e9
+                if remaining <= 0:
+                    # Window closed, just take what is already waiting
+                    if subscriber.empty():
+                        break
+                    event = subscriber.get_nowait()
+                else:
+                    try:
+                        event = await asyncio.wait_for(subscriber.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if event.timestamp_ns > closes:
+                    # Not part of this buzz-in: it, and anything behind it, is left for the next reader
+                    self._held.append(event)
+                    while not subscriber.empty():
+                        self._held.append(subscriber.get_nowait())
+                    break
+                arbiter.offer(event)
+            return arbiter.decide()
+        finally:
+            self._subscribers.discard(subscriber)
+
+    async def first_pressed(self, buzzButton="red", controllers=None, timeout=None):
+        """The controller that buzzed first, or None on timeout."""
+        result = await self.buzz_in(buzzButton, controllers, timeout)
+        if result is None:
+            return None
+        return result.winner
+
+    # -----------------------------
+    # LIGHTS
+    # -----------------------------
+
+    def _ensure_lights_task(self):
+        if self._lights_task is None or self._lights_task.done():
+            self._lights_task = asyncio.get_running_loop().create_task(self._run_lights())
+
+    async def _run_lights(self):
+        # Ticks the animator from the loop instead of its own thread, until nothing is animating
+        lights = self.buzz.lights
+        while lights.is_active():
+            lights.tick()
+            await asyncio.sleep(lights.RESOLUTION)
+        lights.tick()
+
+    async def blink(self, controllers, duration=None, period=1.0):
+        """Blink the controllers, for duration seconds if given (the lights are then put back)."""
+        self.buzz.lights.blink(controllers, period)
+        self._ensure_lights_task()
+        if duration is not None:
+            await asyncio.sleep(duration)
+            self.buzz.lights.clear(controllers)
+
+    async def pulse(self, controllers, duration=None, period=1.0):
+        self.buzz.lights.pulse(controllers, period)
+        self._ensure_lights_task()
+        if duration is not None:
+            await asyncio.sleep(duration)
+            self.buzz.lights.clear(controllers)
+
+    async def flash(self, controllers, duration=0.25):
+        self.buzz.lights.flash(controllers, duration)
+        self._ensure_lights_task()
+        await asyncio.sleep(duration)
+
+    def stop_lights(self, controllers=None):
+        self.buzz.lights.clear(controllers)
@@ -0,0 +1,285 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+from BuzzProtocol import BUTTON_BITS, BUTTONS, PRODUCT_ID, VENDOR_ID
+
+
+def open_backend(name=None):
+    """
+    Open the device BuzzController talks to.
+    The BUZZ_BACKEND environment variable picks it when name is not given:
+      - "hid" (default): the real dongle
+      - "virtual": a VirtualBuzzDevice pressing random buttons, for running without hardware
+      - "replay": the first dongle of the session log in BUZZ_REPLAY, see open_backends
+    """
+    return open_backends(name, count=1)[0]
+
+
+def _open_one(name):
+    if name == "hid":
+        return HidBackend()
+    if name == "virtual":
+        rate = float(os.environ.get("BUZZ_VIRTUAL_RATE", "2"))
+        return VirtualBuzzDevice(random_presses(duration=3600, rate_hz=rate))
+    raise ValueError("Unknown Buzz backend: %s" % name)
+
+
+def find_devices(vendor_id=VENDOR_ID, product_id=PRODUCT_ID):
+    """hid.enumerate() entries for every Buzz dongle plugged in, one per device path."""
+    import hid
+
+    devices = {}
+    for d in hid.enumerate(vendor_id, product_id):
+        devices.setdefault(d["path"], d)
+    return [devices[path] for path in sorted(devices)]
+
+
+def open_backends(name=None, count=None):
+    """
+    Open every device for BuzzManager (or the first count), picked like open_backend.
+    With "virtual", BUZZ_VIRTUAL_DEVICES sets how many dongles to pretend there are.
+    With "replay", BUZZ_REPLAY is the session log to play back and BUZZ_REPLAY_FAST=1
+    plays it as fast as it is read instead of at the speed it was recorded. A game waiting
+    on the event queue can't keep up with that and loses events off the end of it, so replay
+    games at the recorded speed (with the same BUZZ_SEED) and keep fast replays for listeners
+    and benchmarks.
+    BUZZ_RECORD=path records everything the devices send and are sent to a session log.
+    """
+    if name is None:
+        name = os.environ.get("BUZZ_BACKEND", "hid")
+    if name == "hid":
+        if count == 1:
+            backends = [HidBackend()]
+        else:
+            backends = [HidBackend(path=d["path"]) for d in find_devices()]
+            if not backends:
+                raise IOError("No Buzz dongles found")
+    elif name == "replay":
+        import BuzzLog
+
+        backends = BuzzLog.replay_backends(os.environ["BUZZ_REPLAY"],
+                                           realtime=os.environ.get("BUZZ_REPLAY_FAST") != "1")
+    else:
+        if count is None:
+            count = int(os.environ.get("BUZZ_VIRTUAL_DEVICES", "1"))
+        backends = [_open_one(name) for _ in range(count)]
+    backends = backends[:count]
+
+    path = os.environ.get("BUZZ_RECORD")
+    if path:
+        import BuzzLog
+
+        recorder = BuzzLog.Recorder(path)
+        backends = [BuzzLog.RecordingBackend(backend, recorder, device) for device, backend in enumerate(backends)]
+    return backends
+
+
+class HidBackend:
+    """The real Buzz dongle, through hidapi."""
+
+    # Paths currently held open, so a reconnecting backend does not grab another one's dongle
+    _open_paths = set()
+
+    def __init__(self, path=None, vendor_id=VENDOR_ID, product_id=PRODUCT_ID):
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.path = None
+        self.device = None
+        if path is None:
+            path = self._free_path()
+        self._open(path)
+
+    def _free_path(self):
+        """A matching dongle nobody else has open, or None if the system won't list paths."""
+        for d in find_devices(self.vendor_id, self.product_id):
+            if d["path"] not in HidBackend._open_paths:
+                return d["path"]
+        return None
+
+    def _open(self, path):
+        # Imported here so the virtual device works on machines without hidapi
+        import hid
+
+        device = hid.device()
+        if path is not None:
+            device.open_path(path)
+        else:
+            device.open(self.vendor_id, self.product_id)
+        device.set_nonblocking(1)
+        self.device = device
+        self.path = path
+        HidBackend._open_paths.add(path)
+
+    def reopen(self):
+        """
+        Open the dongle again after it went away: the same path if it is back,
+        otherwise any free Buzz dongle (a replugged dongle often gets a new path).
+        Raises IOError if there is none yet. Only enumerates until one turns up, which is cheap.
+        """
+        self.close()
+        paths = [d["path"] for d in find_devices(self.vendor_id, self.product_id)]
+        if self.path in paths:
+            path = self.path
+        else:
+            free = [p for p in paths if p not in HidBackend._open_paths]
+            if not free:
+                raise IOError("Buzz dongle not found")
+            path = free[0]
+        self._open(path)
+
+    def read(self, size, timeout_ms=0):
+        return self.device.read(size, timeout_ms)
+
+    def write(self, data):
+        return self.device.write(data)
+
+    def close(self):
+        HidBackend._open_paths.discard(self.path)
+        try:
+            self.device.close()
+        except (IOError, OSError, ValueError):
+            pass
+
+
+# -----------------------------
+# VIRTUAL DEVICE
+# -----------------------------
+
+def make_report(bits):
+    """Build the 5 byte report the dongle sends for a button bitmask."""
+    return [0x7F, 0x7F, bits & 0xFF, (bits >> 8) & 0xFF, ((bits >> 16) & 0x0F) | 0xF0]
+
+
+def timeline_from_presses(presses):
+    """
+    Turn (at, controller, button, hold) presses into the (at, bits) button
+    states the dongle would report, one per change.
+    """
+    edges = []
+    for at, controller, button, hold in presses:
+        bit = BUTTON_BITS[(controller, button)]
+        edges.append((at, bit, True))
+        edges.append((at + hold, bit, False))
+    edges.sort(key=lambda edge: edge[0])
+
+    timeline = []
+    bits = 0
+    held = {}
+    for at, bit, pressed in edges:
+        # Overlapping presses of one button keep it down until the last is released
+        held[bit] = held.get(bit, 0) + (1 if pressed else -1)
+        bits = bits | bit if held[bit] > 0 else bits & ~bit
+        if timeline and timeline[-1][0] == at:
+            timeline[-1] = (at, bits)
+        else:
+            timeline.append((at, bits))
+    return timeline
+
+
+def random_presses(duration, rate_hz, controllers=range(4), buttons=None, hold=(0.05, 0.2), seed=None):
+    """Presses arriving at random (Poisson) times, rate_hz per second on average."""
+    if buttons is None:
+        buttons = BUTTONS
+    rng = random.Random(seed)
+    presses = []
+    at = rng.expovariate(rate_hz)
+    while at < duration:
+        presses.append((at, rng.choice(list(controllers)), rng.choice(list(buttons)), rng.uniform(*hold)))
+        at += rng.expovariate(rate_hz)
+    return timeline_from_presses(presses)
+
+
+def burst(at=0.0, controllers=range(4), buttons=None, hold=0.1):
+    """Every listed button going down in the same report."""
+    if buttons is None:
+        buttons = BUTTONS
+    return timeline_from_presses([(at, c, b, hold) for c in controllers for b in buttons])
+
+
+class VirtualBuzzDevice:
+    """
+    An in-process stand-in for the dongle.
+    Replays a timeline of (seconds from start, button bits) as reports and records every LED write.
+    With realtime False the reports are handed out as fast as they are read.
+    unplug() and plug() act like pulling the dongle out and putting it back.
+    """
+
+    def __init__(self, timeline=(), realtime=True):
+        self.realtime = realtime
+        self.start_ns = time.monotonic_ns()
+        self.led_writes = []    # (monotonic_ns, frame)
+        self.reports_sent = 0
+        # When the last report handed out became available
+        self.last_due_ns = None
+        self._pending = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.plugged = True
+        self._open = True
+        self.schedule(timeline)
+
+    def schedule(self, timeline, start_ns=None):
+        """Queue more (seconds, bits) states, relative to start_ns (default: when the device was made)."""
+        if start_ns is None:
+            start_ns = self.start_ns
+        with self._cond:
+            for at, bits in timeline:
+                heapq.heappush(self._pending, (start_ns + int(at * 1e9), next(self._order), bits))
+            self._cond.notify_all()
+
+    def set_buttons(self, bits):
+        """Report a new button state straight away."""
+        self.schedule([(0, bits)], time.monotonic_ns())
+
+    def pending(self):
+        return len(self._pending)
+
+    def unplug(self):
+        with self._cond:
+            self.plugged = False
+            self._open = False
+            self._cond.notify_all()
+
+    def plug(self):
+        with self._cond:
+            self.plugged = True
+
+    def reopen(self):
+        if not self.plugged:
+            raise IOError("Buzz dongle not found")
+        self._open = True
+
+    def read(self, size, timeout_ms=0):
+        deadline = time.monotonic_ns() + timeout_ms * 1000000
+        with self._cond:
+            while True:
+                if not self._open:
+                    raise IOError("read error")
+                now = time.monotonic_ns()
+                if self._pending and (not self.realtime or self._pending[0][0] <= now):
+                    due, _, bits = heapq.heappop(self._pending)
+                    self.last_due_ns = due
+                    self.reports_sent += 1
+                    return make_report(bits)[:size]
+                if self._closed or timeout_ms <= 0 or now >= deadline:
+                    return []
+                wait = deadline - now
+                if self._pending:
+                    wait = min(wait, self._pending[0][0] - now)
+                self._cond.wait(wait / 1e9)
+
+    def write(self, data):
+        if not self._open:
+            raise IOError("write error")
+        self.led_writes.append((time.monotonic_ns(), tuple(data)))
+        return len(data)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -1,93 +1,481 @@
-import hid
+import BuzzBackend
+import Metrics
+import queue
+import threading
 import time
+import traceback
+from collections import deque, namedtuple
+from BuzzArbiter import BuzzArbiter
+from LightAnimator import LightAnimator
 
-class BuzzController:
-   light_array     = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-   light_blinking = False
-   buttonState = [
-        {"red": False, "blue": False, "orange": False, "green": False, "yellow": False},
-        {"red": False, "blue": False, "orange": False, "green": False, "yellow": False},
-        {"red": False, "blue": False, "orange": False, "green": False, "yellow": False},
-        {"red": False, "blue": False, "orange": False, "green": False, "yellow": False}
-    ]
+#The report layout lives in BuzzProtocol, imported here so everything can keep getting it from this module
+from BuzzProtocol import (ALL_BUTTONS_MASK, BIT_BUTTONS, BUTTON_BITS, BUTTONS, CONTROLLER_MASKS,
+                          CONTROLLERS_PER_DEVICE, MAX_PLAYERS, PRESS_ORDER)
 
-   def __init__(self):
-        #instantiate the device class
-        self.hid = hid.device()
+#A single edge (press or release) seen on one button, stamped when the report arrived
+ButtonEvent = namedtuple("ButtonEvent", ["timestamp_ns", "seq", "controller", "button", "pressed"])
 
-        #Open up the device
-        self.hid.open(0x54c, 0x1000)
+#The button of the event sent when a dongle goes away or comes back. The event's controller is the
+#dongle's first controller and pressed is False, so code waiting for presses skips over it.
+DISCONNECTED = "disconnected"
+CONNECTED = "connected"
+#What a failing or unplugged device raises
+DEVICE_ERRORS = (IOError, OSError, ValueError)
 
-        #Set the non blocking mode
-        self.hid.set_nonblocking(1)
+#Hot path metrics, only touched while Metrics.ENABLED
+HID_READS = Metrics.counter("hid.reads")
+HID_WRITES = Metrics.counter("hid.writes")
+DECODE_TIME = Metrics.histogram("report.decode")
+QUEUE_DEPTH = Metrics.gauge("events.queue_depth")
+DECISION_LATENCY = Metrics.histogram("buzz_in.press_to_decision")
+LED_COMMITS = Metrics.counter("led.commits")
 
-        #Clear the Buzz Controller LEDs
-        self.hid.write(self.light_array)
+class ButtonState(namedtuple("ButtonState", ["bits", "changed"])):
+   """Immutable snapshot of every button as one integer, plus the bits that changed since the last snapshot."""
+   __slots__ = ()
 
-   def light_blink(self, controller):
-        blink_lights_off = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
-        self.blink_lights_on = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+   def is_pressed(self, controller, button):
+        return (self.bits & BUTTON_BITS[(controller, button)]) != 0
 
-        for i in controller:
-            self.blink_lights_on[i + 2] = 0xFF
+   def any_pressed(self, controllers=None):
+        if controllers is None:
+            return self.bits != 0
+        return any(self.bits & CONTROLLER_MASKS[i] for i in controllers)
 
-        if (not self.light_blinking):
-            self.light_blinking = True
-            blink = True
-            while self.light_blinking:
-                if (blink):
-                    self.hid.write(self.blink_lights_on)
-                else:
-                    self.hid.write(blink_lights_off)
-                blink = not blink
-                time.sleep(0.5)
+   def pressed(self, controller):
+        """First held button on a controller, or None."""
+        if (self.bits & CONTROLLER_MASKS[controller]):
+            for button in PRESS_ORDER:
+                if (self.bits & BUTTON_BITS[(controller, button)]):
+                    return button
+        return None
 
-            self.hid.write(self.light_array)
+   def to_dicts(self, players=CONTROLLERS_PER_DEVICE):
+        """The state in the old list-of-dicts layout."""
+        return [{button: (self.bits & BUTTON_BITS[(i, button)]) != 0 for button in PRESS_ORDER}
+                for i in range(players)]
+
+class BuzzBase:
+   """
+   Waiting for presses, buzz-ins and LED helpers, shared by BuzzController and BuzzManager.
+   Subclasses provide num_players, get_state, get_event, drain_events, lights,
+   stage_light, commit_lights and _reader_running.
+   """
+   light_blinking = False
+
+   def wait_for_press(self, controllers=None, buttons=None, timeout=None):
+        """Wait for a press on one of the given controllers (and buttons), or None on timeout."""
+        if controllers is None:
+            controllers = range(self.num_players)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None
+            if (deadline is not None):
+                remaining = max(0, deadline - time.monotonic())
+            event = self.get_event(remaining)
+            if event is None:
+                return None
+            if (event.pressed and event.controller in controllers and
+                    (buttons is None or event.button in buttons)):
+                return event
 
    def get_button_status(self):
-        data = self.hid.read(5)
-        if data:
-            self.buttonState[0]["red"] = ((data[2] & 0x01) != 0) #red
-            self.buttonState[0]["yellow"] = ((data[2] & 0x02) != 0) #yellow
-            self.buttonState[0]["green"] = ((data[2] & 0x04) != 0) #green
-            self.buttonState[0]["orange"] = ((data[2] & 0x08) != 0) #orange
-            self.buttonState[0]["blue"] = ((data[2] & 0x10) != 0) #blue
-
-            self.buttonState[1]["red"] = ((data[2] & 0x20) != 0) #red
-            self.buttonState[1]["yellow"] = ((data[2] & 0x40) != 0) #yellow
-            self.buttonState[1]["green"] = ((data[2] & 0x80) != 0) #green
-            self.buttonState[1]["orange"] = ((data[3] & 0x01) != 0) #orange
-            self.buttonState[1]["blue"] = ((data[3] & 0x02) != 0) #blue
-
-            self.buttonState[2]["red"] = ((data[3] & 0x04) != 0) #red
-            self.buttonState[2]["yellow"] = ((data[3] & 0x08) != 0) #yellow
-            self.buttonState[2]["green"] = ((data[3] & 0x10) != 0) #green
-            self.buttonState[2]["orange"] = ((data[3] & 0x20) != 0) #orange
-            self.buttonState[2]["blue"] = ((data[3] & 0x40) != 0) #blue
-
-            self.buttonState[3]["red"] = ((data[3] & 0x80) != 0) #red
-            self.buttonState[3]["yellow"] = ((data[4] & 0x01) != 0) #yellow
-            self.buttonState[3]["green"] = ((data[4] & 0x02) != 0) #green
-            self.buttonState[3]["orange"] = ((data[4] & 0x04) != 0) #orange
-            self.buttonState[3]["blue"] = ((data[4] & 0x08) != 0) #blue
-        return self.buttonState
-   
+        return self.get_state().to_dicts(self.num_players)
+
    def get_button_pressed(self, controller):
-        buttons = self.get_button_status()
-        for key, value in buttons[controller].items():
-            if (value):
-                return key
-            
-   def controller_get_first_pressed(self, buzzButton, controllers = [0, 1, 2, 3]):
+        return self.get_state().pressed(controller)
+
+   def controller_get_first_pressed(self, buzzButton, controllers=None, timeout=None):
+        if controllers is None:
+            controllers = range(self.num_players)
+        if (not self._reader_running):
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while deadline is None or time.monotonic() < deadline:
+                bits = self.get_state().bits
+                for i in controllers:
+                    if (bits & BUTTON_BITS[(i, buzzButton)]):
+                        return i
+            return None
+
+        result = self.buzz_in(buzzButton, controllers, timeout)
+        if result is None:
+            return None
+        return result.winner
+
+   def buzz_in(self, buzzButton="red", controllers=None, timeout=None, arbiter=None, rank_window_ms=0):
+        """
+        Wait for a buzz-in and rank everyone who buzzed by report time, see BuzzArbiter.
+        rank_window_ms keeps listening after the first press so slower players get ranked too.
+        Returns a BuzzResult, or None on timeout. Needs the reader thread.
+        """
+        if controllers is None:
+            controllers = range(self.num_players)
+        if arbiter is None:
+            arbiter = BuzzArbiter(buzzButton, controllers)
+
+        #Anything already queued happened before we were asked, so ignore it
+        self.drain_events()
+
+        #Players already holding the button down are tied with each other
+        bits = self.get_state().bits
+        now = time.monotonic_ns()
+        for i in controllers:
+            if (bits & BUTTON_BITS[(i, buzzButton)]):
+                arbiter.offer(ButtonEvent(now, 0, i, buzzButton, True))
+
+        if (not arbiter.has_presses()):
+            event = self.wait_for_press(controllers, (buzzButton,), timeout)
+            if event is None:
+                return None
+            arbiter.offer(event)
+
+        #Take in everything that arrived in the tie window, and anything already queued behind it
+        closes = max(arbiter.window_closes_ns(), arbiter.first_press_ns() + int(rank_window_ms * 1000000))
         while True:
-            buttons = self.get_button_status()
-            for i in controllers:
-                if (buttons[i][buzzButton]):
-                    return i
-                
+            event = self.get_event(max(0, (closes - time.monotonic_ns()) / 1e9))
+            if event is None:
+                break
+            if (event.timestamp_ns > closes):
+                #Not part of this buzz-in, so it is left for whoever reads events next
+                self.unget_event(event)
+                break
+            arbiter.offer(event)
+
+        result = arbiter.decide()
+        if Metrics.ENABLED:
+            DECISION_LATENCY.record(time.monotonic_ns() - arbiter.first_press_ns())
+        return result
+
+   def light_blink(self, controller, period=1.0):
+        #Returns straight away, the animator's timer thread does the blinking
+        self.light_blinking = True
+        self.lights.blink(controller, period)
+        self.lights.start()
+
    def light_blink_stop(self):
         self.light_blinking = False
-        
+        self.lights.clear()
+
    def light_set(self, controller, status):
+        self.stage_light(controller, status)
+        self.commit_lights(rate_limited=False)
+
+class BuzzController(BuzzBase):
+   light_array     = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+   num_players = CONTROLLERS_PER_DEVICE
+   #Turned off when something else (BuzzManager) takes the events from the listeners instead
+   queue_events = True
+
+   #How many events are kept before the oldest ones are dropped
+   EVENT_QUEUE_SIZE = 256
+   #How long the reader thread blocks on the device before checking if it should stop
+   READ_TIMEOUT_MS = 100
+   #Upper bound on LED frames sent per second by commit_lights
+   LED_MAX_WRITES_PER_SEC = 30
+   #Backoff between attempts to reopen a dongle that went away, in seconds
+   RECONNECT_MIN_DELAY = 0.1
+   RECONNECT_MAX_DELAY = 2.0
+
+   def __init__(self, start_reader=True, backend=None):
+        #Each controller gets its own copy of the lights rather than sharing the class list
+        self.light_array = list(self.light_array)
+
+        #One bit per button, see BUTTON_BITS
+        self.buttonBits = 0
+        self._snapshotBits = 0
+
+        #Open up the device, the real dongle unless told otherwise (see BuzzBackend.open_backend)
+        self.hid = backend if backend is not None else BuzzBackend.open_backend()
+        #A replayed session stamps reports and unplugs with when they were recorded (see BuzzLog.ReplayBackend)
+        self._report_time = getattr(self.hid, "report_time_ns", None)
+        #False while the dongle is unplugged; the reader thread keeps trying to reopen it
+        self.connected = True
+        self.reconnects = 0
+
+        #Last LED frame actually sent to the device, and when
+        self._light_lock = threading.RLock()
+        self._sent_frame = None
+        self._last_light_write = 0.0
+        self.led_commits = 0
+        self.led_writes = 0
+
+        #Clear the Buzz Controller LEDs
+        self._write_frame(self.light_array)
+
+        #Blink/pulse/flash patterns, written through the frame buffer
+        self.lights = LightAnimator(self)
+
+        #Press/release events produced by the reader thread
+        self.events = queue.Queue(self.EVENT_QUEUE_SIZE)
+        #Events put back with unget_event, handed out again before the queue
+        self._held = deque()
+        self.events_dropped = 0
+        #Reports consumed from the device, and reports thrown away because they were malformed
+        self.reports_drained = 0
+        self.reports_dropped = 0
+        self._state_lock = threading.Lock()
+        self._report_seq = 0
+        self._reader = None
+        self._reader_running = False
+        self._stop = threading.Event()
+        #Called from the reader thread with every event, see add_listener
+        self._listeners = []
+
+        if (start_reader):
+            self.start_reader()
+
+   def start_reader(self):
+        if (self._reader_running):
+            return
+        self._reader_running = True
+        self._stop.clear()
+        self._reader = threading.Thread(target=self._reader_loop, name="BuzzReader", daemon=True)
+        self._reader.start()
+
+   def stop_reader(self):
+        self._reader_running = False
+        self._stop.set()
+        if (self._reader is not None and self._reader is not threading.current_thread()):
+            self._reader.join()
+        self._reader = None
+
+   def close(self):
+        self.lights.stop()
+        self.stop_reader()
+        self.hid.close()
+
+   def _now(self):
+        #When a report or unplug happened: now, or when it was recorded for a replayed session
+        return self._report_time() if self._report_time else time.monotonic_ns()
+
+   def _reader_loop(self):
+        while self._reader_running:
+            #Blocks until a report arrives or the timeout expires
+            try:
+                data = self.hid.read(5, self.READ_TIMEOUT_MS)
+            except DEVICE_ERRORS:
+                self._emit(self._device_lost())
+                self._reconnect()
+                continue
+            if data:
+                timestamp = self._now()
+                if Metrics.ENABLED:
+                    HID_READS.add()
+                    start = time.perf_counter_ns()
+                    events = self._apply_report(data, timestamp)
+                    DECODE_TIME.record(time.perf_counter_ns() - start)
+                    self._emit(events)
+                    if (self.queue_events):
+                        QUEUE_DEPTH.set(self.events.qsize())
+                else:
+                    self._emit(self._apply_report(data, timestamp))
+
+   def _emit(self, events):
+        for event in events:
+            if (self.queue_events):
+                self._put_event(event)
+            for listener in self._listeners:
+                try:
+                    listener(event)
+                except Exception:
+                    traceback.print_exc()
+
+   def _device_lost(self):
+        #Nothing can be held on a dongle that is not there, release everything before saying so
+        events = []
+        if (self.connected):
+            self.connected = False
+            now = self._now()
+            events = self._apply_bits(0, now)
+            with self._state_lock:
+                self._report_seq += 1
+            events.append(ButtonEvent(now, self._report_seq, 0, DISCONNECTED, False))
+        return events
+
+   def _reconnect(self):
+        #Back off between attempts so an unplugged dongle costs next to nothing
+        delay = self.RECONNECT_MIN_DELAY
+        while self._reader_running:
+            if (self._stop.wait(delay)):
+                return
+            try:
+                self.hid.reopen()
+            except DEVICE_ERRORS:
+                delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+                continue
+
+            self.connected = True
+            self.reconnects += 1
+            #Put the lights back how they were, whatever the dongle came back up showing
+            with self._light_lock:
+                self._sent_frame = None
+                self.commit_lights(rate_limited=False)
+            with self._state_lock:
+                self._report_seq += 1
+            now = self._now()
+            self._emit([ButtonEvent(now, self._report_seq, 0, CONNECTED, False)])
+            return
+
+   def add_listener(self, listener):
+        """
+        Call listener(event) from the reader thread for every event, as well as queueing it.
+        Listeners must be quick, they hold up the reader.
+        """
+        self._listeners = self._listeners + [listener]
+
+   def remove_listener(self, listener):
+        self._listeners = [l for l in self._listeners if l is not listener]
+
+   def _put_event(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            #Nobody is consuming, throw away the oldest event to make room
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                pass
+            self.events_dropped += 1
+            self.events.put_nowait(event)
+
+   def _decode_report(self, data):
+        #The report already packs the buttons in BUTTON_BITS order over bytes 2-4
+        return (data[2] | (data[3] << 8) | (data[4] << 16)) & ALL_BUTTONS_MASK
+
+   def _apply_report(self, data, timestamp):
+        #Decode a report into the current state and return the edges it caused
+        if (len(data) < 5):
+            self.reports_dropped += 1
+            return []
+        self.reports_drained += 1
+        return self._apply_bits(self._decode_report(data), timestamp)
+
+   def _apply_bits(self, bits, timestamp):
+        with self._state_lock:
+            self._report_seq += 1
+            changed = bits ^ self.buttonBits
+            self.buttonBits = bits
+            seq = self._report_seq
+        events = []
+        while changed:
+            lowest = changed & -changed
+            controller, button = BIT_BUTTONS[lowest.bit_length() - 1]
+            events.append(ButtonEvent(timestamp, seq, controller, button, (bits & lowest) != 0))
+            changed ^= lowest
+        return events
+
+   def get_event(self, timeout=None):
+        """Wait for the next press/release event, or None if the timeout expires."""
+        if self._held:
+            return self._held.popleft()
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+   def unget_event(self, event):
+        """Put an event back, so it is the next one get_event returns."""
+        self._held.appendleft(event)
+
+   def drain_events(self):
+        """Return every queued event without waiting."""
+        events = list(self._held)
+        self._held.clear()
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+   def get_state(self):
+        """Snapshot of all buttons; changed holds the bits that differ from the previous snapshot."""
+        if (not self._reader_running):
+            return self.read_all()[0]
+        return self._snapshot()
+
+   def read_all(self, max_reports=None):
+        """
+        Drain every pending report instead of just the oldest one.
+        Returns (ButtonState, transitions) where transitions holds every edge, in order,
+        so presses shorter than the polling interval are not lost.
+        """
+        if (self._reader_running):
+            #The reader thread has already drained the device into the queue
+            return self._snapshot(), self.drain_events()
+
+        transitions = []
+        count = 0
+        while max_reports is None or count < max_reports:
+            try:
+                data = self.hid.read(5)
+            except DEVICE_ERRORS:
+                #Without the reader thread nothing reconnects, the caller just sees everything released
+                transitions.extend(self._device_lost())
+                break
+            if not data:
+                break
+            count += 1
+            transitions.extend(self._apply_report(data, self._now()))
+        return self._snapshot(), transitions
+
+   def _snapshot(self):
+        with self._state_lock:
+            bits = self.buttonBits
+            changed = bits ^ self._snapshotBits
+            self._snapshotBits = bits
+        return ButtonState(bits, changed)
+
+   def light_status(self, controller):
+        """Whether the LED is on in the frame buffer."""
+        return self.light_array[controller+2] != 0x00
+
+   def stage_light(self, controller, status):
+        """Change one LED in the frame buffer without touching the device."""
         self.light_array[controller+2] = 0xFF if status else 0x00
-        self.hid.write(self.light_array)
\ No newline at end of file
+
+   def stage_lights(self, statuses):
+        """Change every LED in the frame buffer, one status per controller."""
+        for i, status in enumerate(statuses):
+            self.light_array[i+2] = 0xFF if status else 0x00
+
+   def commit_lights(self, rate_limited=True):
+        """
+        Send the staged frame if it differs from the last one sent.
+        With rate_limited the write is held back until LED_MAX_WRITES_PER_SEC allows it;
+        the frame stays staged and goes out on a later commit.
+        Returns True if a write was made.
+        """
+        self.led_commits += 1
+        if Metrics.ENABLED:
+            LED_COMMITS.add()
+        with self._light_lock:
+            if (self._sent_frame == self.light_array):
+                return False
+            if (rate_limited and
+                    time.monotonic() - self._last_light_write < 1.0 / self.LED_MAX_WRITES_PER_SEC):
+                return False
+            return self._write_frame(self.light_array)
+
+   def lights_pending(self):
+        """True if the staged frame has not been sent yet."""
+        return self._sent_frame != self.light_array
+
+   def _write_frame(self, frame):
+        with self._light_lock:
+            if (not self.connected):
+                #Stays staged, _reconnect sends it when the dongle is back
+                return False
+            self._last_light_write = time.monotonic()
+            self.led_writes += 1
+            if Metrics.ENABLED:
+                HID_WRITES.add()
+            try:
+                if (self.hid.write(frame) < 0):
+                    raise IOError("write error")
+            except DEVICE_ERRORS:
+                #The reader thread notices on its next read and starts reconnecting
+                self._sent_frame = None
+                return False
+            self._sent_frame = list(frame)
+            return True
+
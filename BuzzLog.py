@@ -0,0 +1,255 @@
+import struct
+import threading
+import time
+
+# Session logs: every raw report and LED frame that went between a game and its dongles,
+# so a session can be looked at, or fed back through BuzzController, afterwards.
+#
+# Layout, little endian and append only:
+#   header  HEADER: magic, then the monotonic_ns and time.time() the log was started at
+#   records RECORD: monotonic_ns, kind, device, payload length, then the payload bytes
+
+MAGIC = b"BUZZLOG1"
+HEADER = struct.Struct("<8sQd")
+RECORD = struct.Struct("<QBBB")
+
+REPORT = 1        # payload: a report read from the dongle
+LED = 2           # payload: an LED frame written to it
+UNPLUGGED = 3     # a read from the dongle failed
+RECONNECTED = 4   # it was opened again
+
+KIND_NAMES = {REPORT: "report", LED: "led", UNPLUGGED: "unplugged", RECONNECTED: "reconnected"}
+
+
+class LogError(ValueError):
+    pass
+
+
+class Recorder:
+    """
+    Appends records to a session log. Safe to share between the backends of several dongles;
+    writes go to a buffered file, flushed every FLUSH_INTERVAL seconds and on close.
+    """
+
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._users = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "wb", buffering=65536)
+        self._file.write(HEADER.pack(MAGIC, time.monotonic_ns(), time.time()))
+        self._last_flush = time.monotonic()
+
+    def write(self, kind, device, payload=b"", timestamp_ns=None):
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        payload = bytes(payload)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(RECORD.pack(timestamp_ns, kind, device, len(payload)) + payload)
+            self.records += 1
+            if time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = time.monotonic()
+
+    def attach(self):
+        with self._lock:
+            self._users += 1
+
+    def detach(self):
+        """Closes the log once the last backend using it has gone."""
+        with self._lock:
+            self._users -= 1
+            last = self._users <= 0
+        if last:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_log(path):
+    """(start_ns, start_time, [(timestamp_ns, kind, device, payload)]) from a session log."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise LogError("%s is not a session log" % path)
+    magic, start_ns, start_time = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise LogError("%s is not a session log" % path)
+
+    records = []
+    offset = HEADER.size
+    while offset + RECORD.size <= len(data):
+        timestamp_ns, kind, device, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + length > len(data):
+            # Cut off part way through a record, e.g. the game was killed
+            break
+        records.append((timestamp_ns, kind, device, data[offset:offset + length]))
+        offset += length
+    return start_ns, start_time, records
+
+
+# -----------------------------
+# BACKENDS
+# -----------------------------
+
+class RecordingBackend:
+    """Wraps another backend and records everything that goes through it to a Recorder."""
+
+    def __init__(self, backend, recorder, device=0):
+        self.backend = backend
+        self.recorder = recorder
+        self.device = device
+        self._report_ns = None
+        recorder.attach()
+
+    def report_time_ns(self):
+        """The stamp the last report, unplug or reconnect was recorded with, so BuzzController uses the same one."""
+        return self._report_ns
+
+    def _stamp(self):
+        stamp = getattr(self.backend, "report_time_ns", None)
+        self._report_ns = stamp() if stamp is not None else time.monotonic_ns()
+        return self._report_ns
+
+    def read(self, size, timeout_ms=0):
+        try:
+            data = self.backend.read(size, timeout_ms)
+        except Exception:
+            self._record(UNPLUGGED, b"", self._stamp())
+            raise
+        if data:
+            self._record(REPORT, data, self._stamp())
+        return data
+
+    def write(self, data):
+        self._record(LED, data)
+        return self.backend.write(data)
+
+    def reopen(self):
+        self.backend.reopen()
+        self._record(RECONNECTED, b"", self._stamp())
+
+    def _record(self, kind, payload=b"", timestamp_ns=None):
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.write(kind, self.device, payload, timestamp_ns)
+
+    def close(self):
+        self.backend.close()
+        if self.recorder is not None:
+            self.recorder.detach()
+            self.recorder = None
+
+    def __getattr__(self, name):
+        # Anything else (unplug(), led_writes, ...) is the wrapped backend's
+        return getattr(self.backend, name)
+
+
+class ReplayBackend:
+    """
+    Feeds one device's reports from a session log back through BuzzController, at the
+    original speed or, with realtime False, as fast as they are read. Unplugs and
+    reconnects happen where they did. LED frames the game writes are kept in led_writes
+    to compare with the recorded ones (recorded_leds).
+
+    Each report is stamped with its recorded offset from the start of the log
+    (report_time_ns), so the same log gives the same events and buzz-in results
+    at any speed. Without realtime the stamps are moved into the past, so
+    nothing waiting on them (like BuzzManager's reordering) holds back.
+    """
+
+    def __init__(self, path_or_records, device=0, realtime=True):
+        if isinstance(path_or_records, str):
+            start_ns, _, records = read_log(path_or_records)
+        else:
+            start_ns, records = path_or_records
+        self.device = device
+        self.realtime = realtime
+        self._records = [(ts - start_ns, kind, data) for ts, kind, dev, data in records
+                         if dev == device and kind != LED]
+        self.recorded_leds = [(ts - start_ns, data) for ts, kind, dev, data in records
+                              if dev == device and kind == LED]
+        self.led_writes = []
+        self.reports_sent = 0
+        self.finished = threading.Event()
+        duration = self._records[-1][0] if self._records else 0
+        self.start_ns = time.monotonic_ns() if realtime else time.monotonic_ns() - duration
+        self._next = 0
+        self._report_ns = None
+        self.plugged = True
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def report_time_ns(self):
+        """When the last report, unplug or reconnect handed out was recorded, moved to this replay's clock."""
+        return self._report_ns
+
+    def _due(self, index):
+        return self.start_ns + self._records[index][0]
+
+    def read(self, size, timeout_ms=0):
+        deadline = time.monotonic_ns() + timeout_ms * 1000000
+        with self._cond:
+            while True:
+                if not self.plugged:
+                    raise IOError("read error")
+                now = time.monotonic_ns()
+                if self._next >= len(self._records):
+                    self.finished.set()
+                    wait = deadline - now
+                elif self.realtime and self._due(self._next) > now:
+                    wait = min(deadline, self._due(self._next)) - now
+                else:
+                    due = self._due(self._next)
+                    _, kind, data = self._records[self._next]
+                    self._next += 1
+                    if kind == UNPLUGGED:
+                        self.plugged = False
+                        self._report_ns = due
+                        raise IOError("read error")
+                    if kind == RECONNECTED:
+                        continue
+                    self._report_ns = due
+                    self.reports_sent += 1
+                    return list(data[:size])
+                if self._closed or timeout_ms <= 0 or now >= deadline:
+                    return []
+                self._cond.wait(wait / 1e9)
+
+    def reopen(self):
+        """Succeeds once the replay reaches the point the dongle came back."""
+        with self._cond:
+            if self._next < len(self._records):
+                if self.realtime and self._due(self._next) > time.monotonic_ns():
+                    raise IOError("Buzz dongle not found")
+                if self._records[self._next][1] == RECONNECTED:
+                    self._report_ns = self._due(self._next)
+                    self._next += 1
+            self.plugged = True
+
+    def write(self, data):
+        if not self.plugged:
+            raise IOError("write error")
+        self.led_writes.append((time.monotonic_ns() - self.start_ns, tuple(data)))
+        return len(data)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+def replay_backends(path, realtime=True):
+    """A ReplayBackend for every device in a session log, for BuzzManager."""
+    start_ns, _, records = read_log(path)
+    devices = sorted({device for _, _, device, _ in records}) or [0]
+    return [ReplayBackend((start_ns, records), device, realtime) for device in devices]
@@ -0,0 +1,193 @@
+import functools
+import heapq
+import threading
+import time
+import traceback
+
+import BuzzBackend
+import Metrics
+from BuzzController import BuzzBase, BuzzController, ButtonState, CONTROLLERS_PER_DEVICE, MAX_PLAYERS, QUEUE_DEPTH
+from LightAnimator import LightAnimator
+
+# Bits one dongle takes up in the merged button state
+BITS_PER_DEVICE = 5 * CONTROLLERS_PER_DEVICE
+
+
+class BuzzManager(BuzzBase):
+    """
+    Every Buzz dongle plugged in, as one set of players: player p is controller p % 4 on device p // 4.
+    Each device has its own blocking reader thread, so no dongle waits on another, and their
+    events are merged into one stream ordered by report time. It has the same API as
+    BuzzController, with player numbers in place of controller numbers. A dongle that is
+    unplugged sends DISCONNECTED for its first player and CONNECTED when it is back.
+    """
+
+    # Events are held back this long before being handed out, so an event from one device that
+    # was stamped earlier but delivered a moment later than another device's still comes out first
+    REORDER_MS = 2
+    # How many merged events are kept before the oldest are dropped
+    EVENT_QUEUE_SIZE = 1024
+
+    def __init__(self, backends=None, start_reader=True):
+        if backends is None:
+            backends = BuzzBackend.open_backends()
+        if len(backends) * CONTROLLERS_PER_DEVICE > MAX_PLAYERS:
+            raise ValueError("At most %d dongles are supported" % (MAX_PLAYERS // CONTROLLERS_PER_DEVICE))
+
+        self.devices = [BuzzController(start_reader=False, backend=backend) for backend in backends]
+        self.num_players = CONTROLLERS_PER_DEVICE * len(self.devices)
+        self.reorder_ns = int(self.REORDER_MS * 1000000)
+        self.events_dropped = 0
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = 0
+        # (device seq, merged seq) of the last report seen from each device
+        self._last_report = [None] * len(self.devices)
+        self._snapshotBits = 0
+        self._listeners = []
+        self._reader_running = False
+
+        self.lights = LightAnimator(self)
+
+        for index, device in enumerate(self.devices):
+            # Events only come through the merged stream
+            device.queue_events = False
+            device.add_listener(functools.partial(self._on_event, index))
+
+        if start_reader:
+            self.start_reader()
+
+    def start_reader(self):
+        for device in self.devices:
+            device.start_reader()
+        self._reader_running = True
+
+    def stop_reader(self):
+        for device in self.devices:
+            device.stop_reader()
+        self._reader_running = False
+
+    def close(self):
+        self.lights.stop()
+        for device in self.devices:
+            device.close()
+        self._reader_running = False
+
+    @property
+    def connected(self):
+        """False while any dongle is unplugged (its reader keeps trying to reopen it)."""
+        return all(device.connected for device in self.devices)
+
+    def disconnected_players(self):
+        return [index * CONTROLLERS_PER_DEVICE + i
+                for index, device in enumerate(self.devices) if not device.connected
+                for i in range(CONTROLLERS_PER_DEVICE)]
+
+    # -----------------------------
+    # EVENTS
+    # -----------------------------
+
+    def _on_event(self, index, event):
+        # Runs on the device's reader thread, or in get_state while the readers are stopped
+        with self._cond:
+            last = self._last_report[index]
+            if last is None or last[0] != event.seq:
+                # Events from one report keep sharing a sequence number, so they still count as a tie
+                self._seq += 1
+                last = self._last_report[index] = (event.seq, self._seq)
+            event = event._replace(seq=last[1], controller=index * CONTROLLERS_PER_DEVICE + event.controller)
+            heapq.heappush(self._heap, event)
+            if len(self._heap) > self.EVENT_QUEUE_SIZE:
+                heapq.heappop(self._heap)
+                self.events_dropped += 1
+            if Metrics.ENABLED:
+                QUEUE_DEPTH.set(len(self._heap))
+            self._cond.notify_all()
+
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                traceback.print_exc()
+
+    def add_listener(self, listener):
+        """Call listener(event) with every merged event, from whichever reader thread saw it."""
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        self._listeners = [l for l in self._listeners if l is not listener]
+
+    def get_event(self, timeout=None):
+        """The earliest event across all devices, or None if the timeout expires."""
+        deadline = None if timeout is None else time.monotonic_ns() + int(timeout * 1e9)
+        with self._cond:
+            while True:
+                now = time.monotonic_ns()
+                wait = None
+                if self._heap:
+                    ready_at = self._heap[0].timestamp_ns + self.reorder_ns
+                    if ready_at <= now:
+                        return heapq.heappop(self._heap)
+                    wait = ready_at - now
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._cond.wait(None if wait is None else wait / 1e9)
+
+    def unget_event(self, event):
+        """Put an event back, so it is the next one get_event returns."""
+        with self._cond:
+            heapq.heappush(self._heap, event)
+
+    def drain_events(self):
+        """Every queued event in time order, without waiting."""
+        with self._cond:
+            events = [heapq.heappop(self._heap) for _ in range(len(self._heap))]
+        return events
+
+    def get_state(self):
+        """Snapshot of every player's buttons, laid out as BUTTON_BITS with player numbers."""
+        if not self._reader_running:
+            # Nothing else is reading the dongles, so read them here; their presses still go in the merged stream
+            for index, device in enumerate(self.devices):
+                for event in device.read_all()[1]:
+                    self._on_event(index, event)
+        bits = 0
+        for index, device in enumerate(self.devices):
+            bits |= device.buttonBits << (index * BITS_PER_DEVICE)
+        with self._cond:
+            changed = bits ^ self._snapshotBits
+            self._snapshotBits = bits
+        return ButtonState(bits, changed)
+
+    def read_all(self):
+        """Like BuzzController.read_all: the state plus every transition since the last call."""
+        return self.get_state(), self.drain_events()
+
+    # -----------------------------
+    # LIGHTS
+    # -----------------------------
+
+    def _device(self, player):
+        return self.devices[player // CONTROLLERS_PER_DEVICE], player % CONTROLLERS_PER_DEVICE
+
+    def light_status(self, player):
+        device, controller = self._device(player)
+        return device.light_status(controller)
+
+    def stage_light(self, player, status):
+        device, controller = self._device(player)
+        device.stage_light(controller, status)
+
+    def stage_lights(self, statuses):
+        for player, status in enumerate(statuses):
+            self.stage_light(player, status)
+
+    def commit_lights(self, rate_limited=True):
+        """Commit every device's frame, see BuzzController.commit_lights. True if any were written."""
+        written = False
+        for device in self.devices:
+            written = device.commit_lights(rate_limited) or written
+        return written
@@ -0,0 +1,28 @@
+"""
+What a Buzz dongle is on the wire: its USB ids and how buttons are packed into a report.
+No imports, so the controller, the backends and small tools like enumerate.py can all use it.
+"""
+
+# The official wired and wireless dongles
+VENDOR_ID = 0x54c
+PRODUCT_ID = 0x1000
+
+# Buttons in the order their bits appear in a report, 5 bits per controller
+BUTTONS = ("red", "yellow", "green", "orange", "blue")
+# Order get_button_pressed checks buttons in when several are held
+PRESS_ORDER = ("red", "blue", "orange", "green", "yellow")
+
+# Each dongle has 4 controllers; BuzzManager numbers players across up to 16 dongles
+CONTROLLERS_PER_DEVICE = 4
+MAX_PLAYERS = 64
+
+# Lookup tables from (controller, colour) to bit and back
+BUTTON_BITS = {}
+BIT_BUTTONS = []
+for _controller in range(MAX_PLAYERS):
+    for _button in BUTTONS:
+        BUTTON_BITS[(_controller, _button)] = 1 << len(BIT_BUTTONS)
+        BIT_BUTTONS.append((_controller, _button))
+CONTROLLER_MASKS = [0x1F << (5 * i) for i in range(MAX_PLAYERS)]
+# Every button on one dongle
+ALL_BUTTONS_MASK = (1 << (5 * CONTROLLERS_PER_DEVICE)) - 1
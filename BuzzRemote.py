@@ -0,0 +1,354 @@
+import collections
+import multiprocessing
+import struct
+import threading
+import time
+import traceback
+from multiprocessing import shared_memory
+
+from BuzzController import (BuzzBase, ButtonEvent, ButtonState, BUTTON_BITS, BUTTONS, CONNECTED,
+                            CONTROLLERS_PER_DEVICE, DISCONNECTED, QUEUE_DEPTH)
+from LightAnimator import LightAnimator
+import Metrics
+
+# Button names are sent as their position in here
+EVENT_CODES = BUTTONS + (DISCONNECTED, CONNECTED)
+# timestamp_ns, seq, controller, button code, pressed
+EVENT_RECORD = "<QQHB?4x"
+# one bit per player's LED, whether the write may be held back by the LED rate limit
+LED_RECORD = "<Q?7x"
+
+
+class SharedRing:
+    """
+    A single-producer, single-consumer ring of fixed-size struct records in shared memory.
+    Only the producer moves head and only the consumer moves tail, so neither side takes a lock.
+    When the ring is full the new record is dropped and counted.
+    """
+
+    # head, tail, dropped, capacity
+    HEADER = struct.Struct("<QQQQ")
+    WORD = struct.Struct("<Q")
+
+    def __init__(self, shm, record, owner):
+        self._shm = shm
+        self._buf = shm.buf
+        self.record = struct.Struct(record)
+        self.capacity = self.HEADER.unpack_from(self._buf)[3]
+        self._owner = owner
+
+    @classmethod
+    def create(cls, record, capacity):
+        size = cls.HEADER.size + struct.calcsize(record) * capacity
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        cls.HEADER.pack_into(shm.buf, 0, 0, 0, 0, capacity)
+        return cls(shm, record, owner=True)
+
+    @classmethod
+    def attach(cls, name, record):
+        return cls(shared_memory.SharedMemory(name=name), record, owner=False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def dropped(self):
+        return self.WORD.unpack_from(self._buf, 16)[0]
+
+    def __len__(self):
+        head, tail = struct.unpack_from("<QQ", self._buf)
+        return head - tail
+
+    def put(self, *values):
+        """Producer side. Returns False if the ring was full and the record was dropped."""
+        head, tail = struct.unpack_from("<QQ", self._buf)
+        if head - tail >= self.capacity:
+            self.WORD.pack_into(self._buf, 16, self.dropped + 1)
+            return False
+        self.record.pack_into(self._buf, self.HEADER.size + (head % self.capacity) * self.record.size, *values)
+        # Publish only after the record is written
+        self.WORD.pack_into(self._buf, 0, head + 1)
+        return True
+
+    def get(self):
+        """Consumer side. The oldest record as a tuple, or None if the ring is empty."""
+        head, tail = struct.unpack_from("<QQ", self._buf)
+        if head == tail:
+            return None
+        values = self.record.unpack_from(self._buf, self.HEADER.size + (tail % self.capacity) * self.record.size)
+        self.WORD.pack_into(self._buf, 8, tail + 1)
+        return values
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+# -----------------------------
+# INPUT PROCESS
+# -----------------------------
+
+def _serve(events_name, leds_name, ready, stop, players, backend_factory, led_poll):
+    # Runs in the input process: owns the dongles, writes their events out and applies LED frames
+    import BuzzBackend
+    from BuzzController import BuzzController
+    from BuzzManager import BuzzManager
+
+    events = SharedRing.attach(events_name, EVENT_RECORD)
+    leds = SharedRing.attach(leds_name, LED_RECORD)
+    parent = multiprocessing.parent_process()
+    try:
+        backends = backend_factory() if backend_factory is not None else BuzzBackend.open_backends()
+        # One dongle needs no merging, which would hold its events back by BuzzManager.REORDER_MS
+        buzz = BuzzController(backend=backends[0]) if len(backends) == 1 else BuzzManager(backends)
+    except Exception:
+        traceback.print_exc()
+        players.value = -1
+        ready.set()
+        events.close()
+        leds.close()
+        return
+
+    players.value = buzz.num_players
+    ready.set()
+    try:
+        while not stop.is_set() and (parent is None or parent.is_alive()):
+            event = buzz.get_event(led_poll)
+            while event is not None:
+                events.put(event.timestamp_ns, event.seq, event.controller,
+                           EVENT_CODES.index(event.button), event.pressed)
+                event = buzz.get_event(0)
+
+            record = leds.get()
+            while record is not None:
+                mask, rate_limited = record
+                for player in range(buzz.num_players):
+                    buzz.stage_light(player, bool(mask >> player & 1))
+                if not rate_limited:
+                    buzz.commit_lights(rate_limited=False)
+                record = leds.get()
+            # Frames held back by the rate limit go out once it allows
+            buzz.commit_lights()
+    finally:
+        buzz.close()
+        events.close()
+        leds.close()
+
+
+class RemoteBuzz(BuzzBase):
+    """
+    A BuzzManager running in its own process, so rendering and everything else in the game
+    cannot hold up reading the dongles or stamping reports. Events come back through a
+    SharedRing and are read without blocking; LED frames go out through another one.
+    It has the same API as BuzzManager. While there are listeners, a thread here reads the
+    events in as they arrive and calls them, so they don't wait for the game to ask for events.
+
+        buzz = RemoteBuzz()
+        result = buzz.buzz_in("red")
+        buzz.close()
+
+    backend_factory, if given, is called in the input process to open the backends
+    (it must be picklable, e.g. a module-level function or a functools.partial of one).
+    """
+
+    EVENT_RING_SIZE = 1024
+    LED_RING_SIZE = 64
+    # How often the input process looks for LED frames when no buttons are moving
+    LED_POLL = 0.005
+    # How long get_event, and the listeners' thread, sleep between looks at an empty ring
+    POLL_INTERVAL = 0.0005
+    START_TIMEOUT = 10.0
+    # Not fork: the game may already be running threads (simple.py opens this on a startup
+    # thread), and a forked copy of their locks can deadlock the input process. The input
+    # process imports the game's main module again, so that mustn't do anything on import
+    START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+    def __init__(self, backend_factory=None):
+        context = multiprocessing.get_context(self.START_METHOD)
+        self._events = SharedRing.create(EVENT_RECORD, self.EVENT_RING_SIZE)
+        self._leds = SharedRing.create(LED_RECORD, self.LED_RING_SIZE)
+        self._stop = context.Event()
+        ready = context.Event()
+        players = context.Value("i", 0)
+
+        self._pending = collections.deque(maxlen=self.EVENT_RING_SIZE)
+        self._bits = 0
+        self._snapshotBits = 0
+        self._disconnected = set()
+        self._frame = 0
+        # The LED ring takes one producer, but the game thread and the lights' timer thread both commit
+        self._light_lock = threading.RLock()
+        self._sent_frame = None
+        self._listeners = []
+        # The event ring takes one consumer, but the game and the listeners' thread both read it in
+        self._poll_lock = threading.RLock()
+        self._listener_thread = None
+        self._reader_running = True
+
+        self._process = context.Process(
+            target=_serve, name="BuzzInput", daemon=True,
+            args=(self._events.name, self._leds.name, ready, self._stop, players, backend_factory, self.LED_POLL))
+        self._process.start()
+        if not ready.wait(self.START_TIMEOUT) or players.value <= 0:
+            self.close()
+            raise IOError("The Buzz input process could not open the dongles")
+        self.num_players = players.value
+        self.lights = LightAnimator(self)
+
+    def close(self):
+        if self._process is None:
+            return
+        if getattr(self, "lights", None) is not None:
+            self.lights.stop()
+        self._stop.set()
+        with self._poll_lock:
+            listener_thread, self._listener_thread = self._listener_thread, None
+        if listener_thread is not None and listener_thread is not threading.current_thread():
+            listener_thread.join()
+        self._process.join(2)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        with self._light_lock:
+            self._process = None
+            self._events.close()
+            self._leds.close()
+        self._reader_running = False
+
+    def start_reader(self):
+        pass
+
+    def stop_reader(self):
+        pass
+
+    @property
+    def events_dropped(self):
+        return self._events.dropped
+
+    @property
+    def connected(self):
+        self._poll()
+        return not self._disconnected
+
+    def disconnected_players(self):
+        self._poll()
+        return [first + i for first in sorted(self._disconnected) for i in range(CONTROLLERS_PER_DEVICE)]
+
+    # -----------------------------
+    # EVENTS
+    # -----------------------------
+
+    def _poll(self):
+        """Take everything waiting in the ring."""
+        with self._poll_lock:
+            if self._process is None:
+                return
+            if Metrics.ENABLED:
+                QUEUE_DEPTH.set(len(self._events))
+            record = self._events.get()
+            while record is not None:
+                timestamp_ns, seq, controller, code, pressed = record
+                event = ButtonEvent(timestamp_ns, seq, controller, EVENT_CODES[code], pressed)
+                if event.button == DISCONNECTED:
+                    self._disconnected.add(controller)
+                elif event.button == CONNECTED:
+                    self._disconnected.discard(controller)
+                else:
+                    bit = BUTTON_BITS[(controller, event.button)]
+                    self._bits = self._bits | bit if pressed else self._bits & ~bit
+                self._pending.append(event)
+                for listener in self._listeners:
+                    try:
+                        listener(event)
+                    except Exception:
+                        traceback.print_exc()
+                record = self._events.get()
+
+    def _listen(self):
+        while True:
+            with self._poll_lock:
+                # Until the listeners are all gone or it is closed
+                if self._listener_thread is not threading.current_thread():
+                    return
+                if not self._listeners:
+                    self._listener_thread = None
+                    return
+            self._poll()
+            time.sleep(self.POLL_INTERVAL)
+
+    def add_listener(self, listener):
+        """Call listener(event) with every event as it arrives, from the listeners' thread."""
+        with self._poll_lock:
+            self._listeners = self._listeners + [listener]
+            if self._process is not None and self._listener_thread is None:
+                self._listener_thread = threading.Thread(target=self._listen, name="BuzzListeners", daemon=True)
+                self._listener_thread.start()
+
+    def remove_listener(self, listener):
+        self._listeners = [l for l in self._listeners if l is not listener]
+
+    def get_event(self, timeout=None):
+        """The next event, or None if the timeout expires."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self._poll()
+            if self._pending:
+                return self._pending.popleft()
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            if self._process is None or not self._process.is_alive():
+                raise IOError("The Buzz input process has stopped")
+            time.sleep(self.POLL_INTERVAL)
+
+    def unget_event(self, event):
+        """Put an event back, so it is the next one get_event returns."""
+        self._pending.appendleft(event)
+
+    def drain_events(self):
+        """Every event waiting, without blocking."""
+        self._poll()
+        events = list(self._pending)
+        self._pending.clear()
+        return events
+
+    def get_state(self):
+        """Snapshot of every player's buttons, as of the last event read in."""
+        self._poll()
+        changed = self._bits ^ self._snapshotBits
+        self._snapshotBits = self._bits
+        return ButtonState(self._bits, changed)
+
+    def read_all(self):
+        return self.get_state(), self.drain_events()
+
+    # -----------------------------
+    # LIGHTS
+    # -----------------------------
+
+    def light_status(self, player):
+        return bool(self._frame >> player & 1)
+
+    def stage_light(self, player, status):
+        with self._light_lock:
+            if status:
+                self._frame |= 1 << player
+            else:
+                self._frame &= ~(1 << player)
+
+    def stage_lights(self, statuses):
+        with self._light_lock:
+            for player, status in enumerate(statuses):
+                self.stage_light(player, status)
+
+    def commit_lights(self, rate_limited=True):
+        """Send the staged frame to the input process if it changed. True if it was sent."""
+        with self._light_lock:
+            if self._process is None or self._frame == self._sent_frame:
+                return False
+            if not self._leds.put(self._frame, rate_limited):
+                return False
+            self._sent_frame = self._frame
+            return True
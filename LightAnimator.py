@@ -0,0 +1,178 @@
+import threading
+import time
+
+from TimerService import shared_service
+
+OFF = "off"
+ON = "on"
+BLINK = "blink"
+PULSE = "pulse"
+
+
+class LightAnimator:
+    """
+    Runs LED patterns for each controller through a BuzzController's (or BuzzManager's) frame buffer.
+    Call tick() from the game loop, or start() to have a TimerService tick it exactly when
+    a light is due to change (the shared one, with its single thread, unless one is given).
+    Controllers without a pattern are left alone so light_set still works for them.
+    """
+
+    # How often loops that poll the animator (BuzzAsync) tick it
+    RESOLUTION = 0.02
+    # Ticks land just after an edge, so rounding can't put them a hair before it
+    EDGE_MARGIN = 0.0001
+
+    def __init__(self, buzz, timers=None):
+        self.buzz = buzz
+        self.timers = timers
+        self._lock = threading.Lock()
+        self._patterns = {}   # controller -> (pattern, period, duty)
+        self._flashes = {}    # controller -> time the flash ends
+        self._saved = {}      # controller -> LED status before the pattern took over
+        self._epoch = time.monotonic()
+        self._timer = None
+        # Bumped by every _wake, so a tick already under way doesn't carry on an old schedule
+        self._schedule = 0
+        self._running = False
+
+    # -----------------------------
+    # PATTERNS
+    # -----------------------------
+
+    def set_pattern(self, controllers, pattern, period=1.0, duty=0.5):
+        """
+        Give each controller a pattern: ON, OFF, BLINK or PULSE.
+        Blinking controllers share one phase so they flash in step.
+        Setting the pattern a controller already has does not restart it.
+        """
+        changed = False
+        with self._lock:
+            for i in controllers:
+                if i not in self._saved:
+                    self._saved[i] = self.buzz.light_status(i)
+                if self._patterns.get(i) != (pattern, period, duty):
+                    self._patterns[i] = (pattern, period, duty)
+                    changed = True
+        if changed:
+            self._wake()
+
+    def steady(self, controllers, status):
+        self.set_pattern(controllers, ON if status else OFF)
+
+    def blink(self, controllers, period=1.0):
+        """On for half the period, off for the other half."""
+        self.set_pattern(controllers, BLINK, period, 0.5)
+
+    def pulse(self, controllers, period=1.0, duty=0.15):
+        """A short blip of light once per period (the Buzz LEDs are either on or off)."""
+        self.set_pattern(controllers, PULSE, period, duty)
+
+    def flash(self, controllers, duration=0.25):
+        """Light the controllers once for duration, then go back to their pattern."""
+        end = time.monotonic() + duration
+        with self._lock:
+            for i in controllers:
+                if i not in self._saved:
+                    self._saved[i] = self.buzz.light_status(i)
+                self._flashes[i] = end
+        self._wake()
+
+    def clear(self, controllers=None):
+        """Stop the patterns and put the LEDs back how they were before."""
+        with self._lock:
+            if controllers is None:
+                controllers = list(self._saved)
+            for i in controllers:
+                self._patterns.pop(i, None)
+                self._flashes.pop(i, None)
+                if i in self._saved:
+                    self.buzz.stage_light(i, self._saved.pop(i))
+        self.buzz.commit_lights(rate_limited=False)
+
+    def is_active(self):
+        return bool(self._patterns or self._flashes)
+
+    # -----------------------------
+    # DRIVING
+    # -----------------------------
+
+    def tick(self, now=None, rate_limited=True):
+        """Stage the LED state for the current time and commit it."""
+        if now is None:
+            now = time.monotonic()
+        elapsed = now - self._epoch
+
+        with self._lock:
+            for i, end in list(self._flashes.items()):
+                if now >= end:
+                    del self._flashes[i]
+                    if i not in self._patterns:
+                        self.buzz.stage_light(i, self._saved.pop(i))
+
+            for i, (pattern, period, duty) in self._patterns.items():
+                if i in self._flashes:
+                    continue
+                if pattern == ON:
+                    status = True
+                elif pattern == OFF:
+                    status = False
+                else:
+                    status = (elapsed % period) < period * duty
+                self.buzz.stage_light(i, status)
+
+            for i in self._flashes:
+                self.buzz.stage_light(i, True)
+
+        self.buzz.commit_lights(rate_limited)
+
+    def next_change(self, now=None):
+        """When a light is next due to change (a time.monotonic() time), or None if none will."""
+        if now is None:
+            now = time.monotonic()
+        elapsed = now - self._epoch
+        changes = []
+        with self._lock:
+            changes.extend(self._flashes.values())
+            for pattern, period, duty in self._patterns.values():
+                if pattern in (BLINK, PULSE):
+                    phase = elapsed % period
+                    lit = period * duty
+                    changes.append(now + (lit - phase if phase < lit else period - phase))
+        return min(changes) + self.EDGE_MARGIN if changes else None
+
+    def start(self):
+        """Tick from a TimerService whenever a light is due to change."""
+        if self._running:
+            return
+        if self.timers is None:
+            self.timers = shared_service()
+        self._running = True
+        self._wake()
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+
+    def _wake(self):
+        # Patterns changed: tick now, which works out when to tick next
+        if not self._running:
+            return
+        with self._lock:
+            self._schedule += 1
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = self.timers.call_later(0, self._timed_tick, self._schedule)
+
+    def _timed_tick(self, schedule):
+        if not self._running or schedule != self._schedule:
+            return
+        now = self.timers.clock()
+        # Only edges get here, a handful a second, so they go straight out
+        self.tick(now, rate_limited=False)
+        change = self.next_change(now)
+        with self._lock:
+            if change is not None and self._running and schedule == self._schedule:
+                self._timer = self.timers.call_at(change, self._timed_tick, schedule)
@@ -0,0 +1,226 @@
+"""
+Counters and histograms for the hot paths, switched off unless asked for.
+
+Every call site checks the module flag first, so when it is off they cost one attribute lookup:
+
+    if Metrics.ENABLED:
+        HID_READS.add()
+
+Environment:
+  BUZZ_METRICS=1              turn them on
+  BUZZ_METRICS_FILE=path      also append a JSON snapshot to path every BUZZ_METRICS_INTERVAL
+                              seconds (default 5), one per line
+"""
+import json
+import os
+import threading
+import time
+
+ENABLED = False
+
+# Histogram buckets are powers of two of nanoseconds: bucket n holds values below 2**n
+BUCKETS = 48
+
+
+class Counter:
+    """A running total. Updates from several threads may very rarely lose one, fine for metrics."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+
+    def add(self, n=1):
+        self.count += n
+
+
+class Gauge:
+    """The latest value of something, and the highest it has been."""
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+        self.peak = 0
+
+    def set(self, value):
+        self.value = value
+        if value > self.peak:
+            self.peak = value
+
+
+class Histogram:
+    """Durations in nanoseconds, in log2 buckets so recording is a few integer operations."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = [0] * BUCKETS
+
+    def record(self, value_ns):
+        value_ns = max(0, int(value_ns))
+        self.count += 1
+        self.total += value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+        self.buckets[min(value_ns.bit_length(), BUCKETS - 1)] += 1
+
+    def time(self):
+        """with histogram.time(): ... records how long the block took."""
+        return _Timer(self)
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter_ns() - self.start)
+
+
+_lock = threading.Lock()
+_metrics = {}
+
+
+def _get(kind, name):
+    metric = _metrics.get(name)
+    if metric is None:
+        with _lock:
+            metric = _metrics.setdefault(name, kind(name))
+    return metric
+
+
+def counter(name):
+    return _get(Counter, name)
+
+
+def gauge(name):
+    return _get(Gauge, name)
+
+
+def histogram(name):
+    return _get(Histogram, name)
+
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+
+# -----------------------------
+# SNAPSHOTS
+# -----------------------------
+
+def _percentile(buckets, count, fraction, largest):
+    # Interpolated inside the log2 bucket the value falls in, so only an estimate
+    target = fraction * count
+    seen = 0
+    for n, bucket in enumerate(buckets):
+        if bucket and seen + bucket >= target:
+            low = (1 << (n - 1)) if n else 0
+            value = low + (target - seen) / bucket * ((1 << n) - low)
+            return min(value, largest) / 1e6
+        seen += bucket
+    return 0.0
+
+
+def snapshot(previous=None):
+    """
+    Every metric as plain data. Given the snapshot before it, counters also get a rate
+    per second and histograms only cover what was recorded in between.
+    """
+    now = time.monotonic()
+    result = {"time": time.time(), "monotonic": now, "counters": {}, "gauges": {}, "histograms": {}}
+    elapsed = now - previous["monotonic"] if previous else None
+
+    for name, metric in sorted(_metrics.items()):
+        if isinstance(metric, Counter):
+            entry = {"total": metric.count}
+            if elapsed:
+                before = previous["counters"].get(name, {}).get("total", 0)
+                entry["per_sec"] = (metric.count - before) / elapsed
+            result["counters"][name] = entry
+        elif isinstance(metric, Gauge):
+            result["gauges"][name] = {"value": metric.value, "peak": metric.peak}
+        else:
+            buckets = list(metric.buckets)
+            count, total = metric.count, metric.total
+            before = previous["histograms"].get(name) if previous else None
+            if before:
+                buckets = [now_count - then for now_count, then in zip(buckets, before["buckets"])]
+                count -= before["count_total"]
+                total -= before["total_ns"]
+            result["histograms"][name] = {
+                "count": count,
+                "mean_ms": total / count / 1e6 if count else 0.0,
+                "p50_ms": _percentile(buckets, count, 0.50, metric.max),
+                "p99_ms": _percentile(buckets, count, 0.99, metric.max),
+                "max_ms": metric.max / 1e6,
+                # Cumulative, so the next snapshot can take the difference
+                "count_total": metric.count,
+                "total_ns": metric.total,
+                "buckets": list(metric.buckets),
+            }
+    return result
+
+
+def _for_output(snap):
+    # Leave the raw buckets out of what people read
+    snap = dict(snap)
+    snap["histograms"] = {name: {k: v for k, v in h.items() if k not in ("buckets", "count_total", "total_ns")}
+                          for name, h in snap["histograms"].items()}
+    return snap
+
+
+def ratio(snap, numerator, denominator):
+    """numerator / denominator of two counters' rates (or totals), or None."""
+    top = snap["counters"].get(numerator, {})
+    bottom = snap["counters"].get(denominator, {})
+    key = "per_sec" if "per_sec" in top and "per_sec" in bottom else "total"
+    if not bottom.get(key):
+        return None
+    return top.get(key, 0) / bottom[key]
+
+
+# -----------------------------
+# DUMPING
+# -----------------------------
+
+class Dumper:
+    """Appends a JSON snapshot to a file every interval seconds from a daemon thread."""
+
+    def __init__(self, path, interval=5.0):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="BuzzMetrics", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        previous = snapshot()
+        while not self._stop.wait(self.interval):
+            previous = self.dump(previous)
+
+    def dump(self, previous=None):
+        snap = snapshot(previous)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(_for_output(snap)) + "\n")
+        return snap
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def configure_from_env():
+    """Apply the BUZZ_METRICS* environment variables. Returns the Dumper if one was started."""
+    if os.environ.get("BUZZ_METRICS", "0") not in ("", "0"):
+        enable()
+    path = os.environ.get("BUZZ_METRICS_FILE")
+    if path:
+        enable()
+        return Dumper(path, float(os.environ.get("BUZZ_METRICS_INTERVAL", "5")))
+    return None
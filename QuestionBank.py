@@ -0,0 +1,362 @@
+import csv
+import io
+import json
+import os
+import random
+import sqlite3
+from collections import namedtuple
+
+# The buttons answers go on, in the order they are handed out
+ANSWER_BUTTONS = ("blue", "orange", "green", "yellow")
+
+# answers: the correct answer first, then the wrong ones (2 to 4 in all)
+Question = namedtuple("Question", ["id", "category", "difficulty", "question", "answers"])
+
+# CSV banks need these columns, any further ones are extra wrong answers
+CSV_COLUMNS = ("id", "category", "difficulty", "question", "correct")
+
+
+class QuestionBankError(ValueError):
+    pass
+
+
+def shuffle_answers(question, rng):
+    """
+    Put a question's answers on randomly chosen buttons.
+    Returns the dict quizGame uses: {"id", "question", "category", "difficulty",
+    "correct": button, "answers": [buttons in use], <button>: answer, ...}
+    """
+    buttons = list(ANSWER_BUTTONS)
+    rng.shuffle(buttons)
+    buttons = buttons[:len(question.answers)]
+
+    served = {"id": question.id, "question": question.question, "category": question.category,
+              "difficulty": question.difficulty, "correct": buttons[0],
+              "answers": [button for button in ANSWER_BUTTONS if button in buttons]}
+    for button, answer in zip(buttons, question.answers):
+        served[button] = answer
+    return served
+
+
+def _record_to_question(record, line):
+    try:
+        answers = [str(answer) for answer in record["answers"] if answer not in (None, "")]
+        question = Question(str(record["id"]), str(record.get("category") or ""),
+                            int(record.get("difficulty") or 0), str(record["question"]), answers)
+    except (KeyError, TypeError, ValueError) as e:
+        raise QuestionBankError("Bad question on line %d: %s" % (line, e))
+    if not 2 <= len(question.answers) <= len(ANSWER_BUTTONS):
+        raise QuestionBankError("Question %s on line %d needs 2 to %d answers"
+                                % (question.id, line, len(ANSWER_BUTTONS)))
+    return question
+
+
+def parse_jsonl(raw, line=0):
+    """One JSON Lines record: {"id", "category", "difficulty", "question", "answers": [correct, wrong...]}."""
+    try:
+        record = json.loads(raw.decode("utf-8"))
+    except ValueError as e:
+        raise QuestionBankError("Bad JSON on line %d: %s" % (line, e))
+    return _record_to_question(record, line)
+
+
+def parse_csv(raw, columns, line=0):
+    """One CSV record, with the columns from the file's header row."""
+    values = next(csv.reader(io.StringIO(raw.decode("utf-8"))), [])
+    record = dict(zip(columns, values))
+    record["answers"] = [record.get("correct")] + values[len(CSV_COLUMNS):]
+    return _record_to_question(record, line)
+
+
+def iter_records(f, csv_format=False):
+    """
+    Yield (offset, length, line, raw bytes) for every record in a binary file, without
+    holding more than one record in memory. CSV records may run over several lines
+    inside quotes, and blank lines are skipped.
+    """
+    offset = 0
+    line = 0
+    start = None
+    start_line = 0
+    chunks = []
+    for raw in f:
+        line += 1
+        if start is None:
+            if not raw.strip():
+                offset += len(raw)
+                continue
+            start = offset
+            start_line = line
+        offset += len(raw)
+        chunks.append(raw)
+        if csv_format and b"".join(chunks).count(b'"') % 2:
+            # Still inside a quoted field
+            continue
+        record = b"".join(chunks)
+        chunks = []
+        yield start, len(record), start_line, record
+        start = None
+    if chunks:
+        record = b"".join(chunks)
+        yield start, len(record), start_line, record
+
+
+def read_csv_header(records, path):
+    """Take the header row off iter_records() for a CSV file and check it, returns the column names."""
+    header = next(records, None)
+    if header is None:
+        raise QuestionBankError("%s is empty" % path)
+    columns = next(csv.reader(io.StringIO(header[3].decode("utf-8-sig"))))
+    if tuple(columns[:len(CSV_COLUMNS)]) != CSV_COLUMNS:
+        raise QuestionBankError("%s must start with the columns %s" % (path, ",".join(CSV_COLUMNS)))
+    return columns
+
+
+def read_questions(path):
+    """Every question in a JSON Lines or CSV file, one at a time."""
+    csv_format = path.lower().endswith(".csv")
+    with open(path, "rb") as f:
+        records = iter_records(f, csv_format)
+        columns = read_csv_header(records, path) if csv_format else None
+        for offset, length, line, raw in records:
+            yield parse_csv(raw, columns, line) if csv_format else parse_jsonl(raw, line)
+
+
+class QuestionBank:
+    """
+    A question file (JSON Lines, or CSV with a header) that is never loaded whole.
+    The first time it is opened it is streamed once to build an index next to it
+    (<file>.idx, an SQLite database of id, category, difficulty and byte offset),
+    which is rebuilt whenever the file changes. After that, only the questions
+    actually asked are read, and their answers are shuffled onto buttons as they are served.
+
+        bank = QuestionBank("questions.jsonl")
+        for question in bank.deal(10, category="Geography"):
+            print(question["question"], question["correct"])
+    """
+
+    INDEX_SUFFIX = ".idx"
+    # Index format, bump it when the schema changes
+    INDEX_VERSION = 1
+
+    def __init__(self, path, index_path=None, rng=None):
+        self.path = path
+        self.index_path = index_path or path + self.INDEX_SUFFIX
+        self.rng = rng if rng is not None else random.Random()
+        self.csv_format = path.lower().endswith(".csv")
+        self.columns = None
+
+        self._file = open(path, "rb")
+        # It may be opened on one thread (simple.py's startup) and dealt from another,
+        # though only ever used by one at a time
+        self._db = sqlite3.connect(self.index_path, check_same_thread=False)
+        try:
+            if not self._index_is_current():
+                self.build_index()
+        except Exception:
+            self.close()
+            raise
+        self._db.execute("CREATE TEMP TABLE IF NOT EXISTS served (id TEXT PRIMARY KEY)")
+        if self.csv_format:
+            self.columns = json.loads(self._meta("columns"))
+
+    def close(self):
+        self._db.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -----------------------------
+    # INDEX
+    # -----------------------------
+
+    def _source_signature(self):
+        stat = os.stat(self.path)
+        return "%d:%d:%d" % (self.INDEX_VERSION, stat.st_size, stat.st_mtime_ns)
+
+    def _meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _index_is_current(self):
+        try:
+            return self._meta("source") == self._source_signature()
+        except sqlite3.DatabaseError:
+            return False
+
+    def build_index(self):
+        """Stream the whole file once and write the index. Returns how many questions it has."""
+        db = self._db
+        db.executescript("""
+            DROP TABLE IF EXISTS meta;
+            DROP TABLE IF EXISTS questions;
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE questions (
+                id TEXT PRIMARY KEY,
+                category TEXT NOT NULL,
+                difficulty INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                line INTEGER NOT NULL
+            );
+        """)
+
+        rows = []
+        count = 0
+        self._file.seek(0)
+        records = iter_records(self._file, self.csv_format)
+        if self.csv_format:
+            self.columns = read_csv_header(records, self.path)
+            db.execute("INSERT INTO meta VALUES ('columns', ?)", (json.dumps(self.columns),))
+
+        for offset, length, line, raw in records:
+            question = self._parse(raw, line)
+            rows.append((question.id, question.category, question.difficulty, offset, length, line))
+            if len(rows) >= 1000:
+                self._insert(rows)
+                count += len(rows)
+                rows = []
+        self._insert(rows)
+        count += len(rows)
+
+        db.execute("CREATE INDEX questions_category ON questions (category, difficulty)")
+        db.execute("CREATE INDEX questions_difficulty ON questions (difficulty)")
+        db.execute("INSERT INTO meta VALUES ('source', ?)", (self._source_signature(),))
+        db.commit()
+        return count
+
+    def _insert(self, rows):
+        try:
+            self._db.executemany("INSERT INTO questions VALUES (?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.IntegrityError:
+            raise QuestionBankError("%s uses a question id more than once" % self.path)
+
+    def _parse(self, raw, line=0):
+        if self.csv_format:
+            return parse_csv(raw, self.columns, line)
+        return parse_jsonl(raw, line)
+
+    # -----------------------------
+    # QUERIES
+    # -----------------------------
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+
+    def categories(self):
+        """{category: number of questions}"""
+        return dict(self._db.execute("SELECT category, COUNT(*) FROM questions GROUP BY category ORDER BY category"))
+
+    def difficulties(self, category=None):
+        """{difficulty: number of questions}, in one category if given."""
+        if category is None:
+            rows = self._db.execute("SELECT difficulty, COUNT(*) FROM questions GROUP BY difficulty")
+        else:
+            rows = self._db.execute("SELECT difficulty, COUNT(*) FROM questions WHERE category = ? "
+                                    "GROUP BY difficulty", (category,))
+        return dict(rows)
+
+    def _where(self, category, difficulty, repeat):
+        clauses = []
+        params = []
+        if category is not None:
+            clauses.append("category = ?")
+            params.append(category)
+        if difficulty is not None:
+            if isinstance(difficulty, (tuple, list)):
+                clauses.append("difficulty BETWEEN ? AND ?")
+                params.extend(difficulty)
+            else:
+                clauses.append("difficulty = ?")
+                params.append(difficulty)
+        if not repeat:
+            clauses.append("id NOT IN (SELECT id FROM served)")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, category=None, difficulty=None, repeat=True):
+        """How many questions match (repeat=False leaves out the ones already served)."""
+        where, params = self._where(category, difficulty, repeat)
+        return self._db.execute("SELECT COUNT(*) FROM questions" + where, params).fetchone()[0]
+
+    def get(self, question_id):
+        """Read one question by id, or None if there isn't one."""
+        row = self._db.execute("SELECT offset, length, line FROM questions WHERE id = ?",
+                               (str(question_id),)).fetchone()
+        if row is None:
+            return None
+        return self._load(*row)
+
+    def _load(self, offset, length, line):
+        self._file.seek(offset)
+        return self._parse(self._file.read(length), line)
+
+    def sample(self, n, category=None, difficulty=None, repeat=False):
+        """
+        Up to n question ids picked at random, with no repeats. Unless repeat is True,
+        questions already served by this bank are left out too.
+        difficulty is a number or an inclusive (lowest, highest) range.
+        """
+        where, params = self._where(category, difficulty, repeat)
+        count = self._db.execute("SELECT COUNT(*) FROM questions" + where, params).fetchone()[0]
+        # Positions are picked with self.rng rather than SQLite's random(), so a seeded bank deals
+        # the same questions, and only the picked ids are read out of the index
+        positions = self.rng.sample(range(count), min(n, count))
+
+        # Counted in the order of the index the filter uses (rowid, or difficulty then rowid), so
+        # SQLite never sorts, and fetched in one pass: each pick seeks to the one before and skips on
+        # from there, so a deal reads through the matching rows at most once
+        by_difficulty = category is not None or difficulty is not None
+        order = "category, difficulty, rowid" if category is not None else "difficulty, rowid"
+        ids = {}
+        previous = -1
+        row = None
+        for position in sorted(positions):
+            skip = position - previous - 1
+            if row is None:
+                row = self._nth(where, params, order if by_difficulty else "rowid", skip)
+            elif not by_difficulty:
+                row = self._nth(self._and(where, "rowid > ?"), params + [row[2]], "rowid", skip)
+            else:
+                # The rest of the last pick's difficulty first, then on through the ones after it
+                same, same_params = self._and(where, "difficulty = ? AND rowid > ?"), params + [row[1], row[2]]
+                found = self._nth(same, same_params, "rowid", skip)
+                if found is None:
+                    skip -= self._db.execute("SELECT COUNT(*) FROM questions" + same, same_params).fetchone()[0]
+                    found = self._nth(self._and(where, "difficulty > ?"), params + [row[1]], order, skip)
+                row = found
+            ids[position] = row[0]
+            previous = position
+        return [ids[position] for position in positions]
+
+    @staticmethod
+    def _and(where, clause):
+        return where + (" AND " if where else " WHERE ") + clause
+
+    def _nth(self, where, params, order, skip):
+        # (id, difficulty, rowid) of the row skip places along in order, or None past the end
+        return self._db.execute("SELECT id, difficulty, rowid FROM questions" + where +
+                                " ORDER BY " + order + " LIMIT 1 OFFSET ?", params + [skip]).fetchone()
+
+    # -----------------------------
+    # SERVING
+    # -----------------------------
+
+    def serve(self, question):
+        """Shuffle a question (or question id) onto the buttons, see shuffle_answers, and mark it served."""
+        if not isinstance(question, Question):
+            question = self.get(question)
+        self._db.execute("INSERT OR IGNORE INTO served VALUES (?)", (question.id,))
+        return shuffle_answers(question, self.rng)
+
+    def deal(self, n, category=None, difficulty=None, repeat=False):
+        """Pick n questions and yield them one at a time, each read and shuffled only when it is reached."""
+        for question_id in self.sample(n, category, difficulty, repeat):
+            yield self.serve(question_id)
+
+    def reset(self):
+        """Forget which questions have been served."""
+        self._db.execute("DELETE FROM served")
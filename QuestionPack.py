@@ -0,0 +1,338 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+from QuestionBank import ANSWER_BUTTONS, Question, QuestionBank, QuestionBankError, read_questions, shuffle_answers
+
+# Question packs are question files compiled into one binary file that is opened with mmap,
+# so opening one costs the same whatever its size and every game on the host shares its pages.
+#
+# Layout, all little endian:
+#   header         HEADER
+#   question table QUESTION per question: string numbers, difficulty and answer count
+#   string offsets (strings + 1) u32 offsets into the pool, string n is pool[offsets[n]:offsets[n + 1]]
+#   string pool    UTF-8, every distinct string once
+#   category table CATEGORY per category, sorted by name
+#   index arrays   u32 question numbers: one per category and one for every question, each sorted
+#                  by (difficulty, number), then one sorted by id
+
+PACK_SUFFIX = ".qpk"
+MAGIC = b"BUZZQPK\0"
+VERSION = 1
+
+# magic, version, question count, category count, string count, then the offsets of the
+# question table, string offsets, string pool, category table, all-questions index and id index
+HEADER = struct.Struct("<8sIIIIQQQQQQ")
+# id, category, difficulty, answer count, question, answers (0xffffffff when unused)
+QUESTION = struct.Struct("<IIhHI%dI" % len(ANSWER_BUTTONS))
+# name, question count, offset of its index array
+CATEGORY = struct.Struct("<IIQ")
+U32 = struct.Struct("<I")
+NO_STRING = 0xffffffff
+
+
+# -----------------------------
+# BUILDING
+# -----------------------------
+
+def build_pack(sources, output):
+    """Compile question files (JSON Lines or CSV) into a pack. Returns how many questions went in."""
+    strings = {}
+    questions = []
+
+    def intern(text):
+        number = strings.get(text)
+        if number is None:
+            number = strings[text] = len(strings)
+        return number
+
+    ids = set()
+    for source in sources:
+        for question in read_questions(source):
+            if question.id in ids:
+                raise QuestionBankError("Question id %s is in %s more than once" % (question.id, ", ".join(sources)))
+            ids.add(question.id)
+            answers = [intern(answer) for answer in question.answers]
+            answers += [NO_STRING] * (len(ANSWER_BUTTONS) - len(answers))
+            questions.append((intern(question.id), intern(question.category), question.difficulty,
+                              len(question.answers), intern(question.question), answers))
+
+    pool = []
+    offsets = [0]
+    for text in strings:
+        pool.append(text.encode("utf-8"))
+        offsets.append(offsets[-1] + len(pool[-1]))
+    pool = b"".join(pool)
+    string_list = list(strings)
+
+    by_category = {}
+    for number, question in enumerate(questions):
+        by_category.setdefault(string_list[question[1]], []).append(number)
+
+    def by_difficulty(numbers):
+        return sorted(numbers, key=lambda number: (questions[number][2], number))
+
+    question_table = HEADER.size
+    string_offsets = question_table + QUESTION.size * len(questions)
+    string_pool = string_offsets + U32.size * len(offsets)
+    category_table = string_pool + len(pool)
+    all_index = category_table + CATEGORY.size * len(by_category)
+
+    categories = []
+    index_arrays = [by_difficulty(range(len(questions)))]
+    position = all_index + U32.size * len(questions)
+    for name in sorted(by_category):
+        numbers = by_difficulty(by_category[name])
+        categories.append(CATEGORY.pack(strings[name], len(numbers), position))
+        index_arrays.append(numbers)
+        position += U32.size * len(numbers)
+    id_index = position
+    index_arrays.append(sorted(range(len(questions)), key=lambda number: string_list[questions[number][0]].encode("utf-8")))
+
+    # Written next to the output and renamed over it, so a running game never sees half a pack
+    temp = output + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(questions), len(by_category), len(strings),
+                            question_table, string_offsets, string_pool, category_table, all_index, id_index))
+        for question_id, category, difficulty, count, text, answers in questions:
+            f.write(QUESTION.pack(question_id, category, difficulty, count, text, *answers))
+        f.write(struct.pack("<%dI" % len(offsets), *offsets))
+        f.write(pool)
+        f.write(b"".join(categories))
+        for numbers in index_arrays:
+            f.write(struct.pack("<%dI" % len(numbers), *numbers))
+    os.replace(temp, output)
+    return len(questions)
+
+
+# -----------------------------
+# READING
+# -----------------------------
+
+class QuestionPack:
+    """
+    A built question pack, with the same queries as QuestionBank. Opening it only reads the
+    header; questions are decoded from the mapped file when they are served.
+
+        pack = QuestionPack("questions.qpk")
+        for question in pack.deal(10, category="Geography"):
+            print(question["question"], question["correct"])
+    """
+
+    def __init__(self, path, rng=None):
+        self.path = path
+        self.rng = rng if rng is not None else random.Random()
+        self._served = set()
+        self._categories = None
+
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            self._map.close()
+            raise QuestionBankError("%s is not a question pack" % path)
+        (magic, version, self._count, self._category_count, self._string_count, self._question_table,
+         self._string_offsets, self._string_pool, self._category_table, self._all_index,
+         self._id_index) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise QuestionBankError("%s is not a version %d question pack" % (path, VERSION))
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -----------------------------
+    # DECODING
+    # -----------------------------
+
+    def _string(self, number):
+        start, end = struct.unpack_from("<II", self._map, self._string_offsets + U32.size * number)
+        return self._map[self._string_pool + start:self._string_pool + end].decode("utf-8")
+
+    def _string_bytes(self, number):
+        start, end = struct.unpack_from("<II", self._map, self._string_offsets + U32.size * number)
+        return self._map[self._string_pool + start:self._string_pool + end]
+
+    def _question(self, number):
+        fields = QUESTION.unpack_from(self._map, self._question_table + QUESTION.size * number)
+        question_id, category, difficulty, count, text = fields[:5]
+        return Question(self._string(question_id), self._string(category), difficulty, self._string(text),
+                        [self._string(answer) for answer in fields[5:5 + count]])
+
+    def _difficulty(self, number):
+        return QUESTION.unpack_from(self._map, self._question_table + QUESTION.size * number)[2]
+
+    def _entry(self, index, position):
+        return U32.unpack_from(self._map, index + U32.size * position)[0]
+
+    def _load_categories(self):
+        if self._categories is None:
+            self._categories = {}
+            for n in range(self._category_count):
+                name, count, index = CATEGORY.unpack_from(self._map, self._category_table + CATEGORY.size * n)
+                self._categories[self._string(name)] = (index, count)
+        return self._categories
+
+    def _bound(self, index, lo, hi, difficulty):
+        # First position in index[lo:hi] whose difficulty is not below difficulty
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._difficulty(self._entry(index, mid)) < difficulty:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _range(self, category, difficulty):
+        """(index array, start, end) of the questions that match."""
+        if category is None:
+            index, count = self._all_index, self._count
+        else:
+            index, count = self._load_categories().get(category, (self._all_index, 0))
+        lo, hi = 0, count
+        if difficulty is not None:
+            low, high = difficulty if isinstance(difficulty, (tuple, list)) else (difficulty, difficulty)
+            lo = self._bound(index, 0, count, low)
+            hi = self._bound(index, lo, count, high + 1)
+        return index, lo, hi
+
+    # -----------------------------
+    # QUERIES
+    # -----------------------------
+
+    def __len__(self):
+        return self._count
+
+    def categories(self):
+        """{category: number of questions}"""
+        return {name: count for name, (index, count) in self._load_categories().items()}
+
+    def difficulties(self, category=None):
+        """{difficulty: number of questions}, in one category if given."""
+        index, lo, end = self._range(category, None)
+        counts = {}
+        while lo < end:
+            difficulty = self._difficulty(self._entry(index, lo))
+            hi = self._bound(index, lo, end, difficulty + 1)
+            counts[difficulty] = hi - lo
+            lo = hi
+        return counts
+
+    def count(self, category=None, difficulty=None, repeat=True):
+        """How many questions match (repeat=False leaves out the ones already served)."""
+        index, lo, hi = self._range(category, difficulty)
+        if repeat or not self._served:
+            return hi - lo
+        return sum(1 for position in range(lo, hi) if self._entry(index, position) not in self._served)
+
+    def _find(self, question_id):
+        # Binary search of the id index
+        key = str(question_id).encode("utf-8")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            number = self._entry(self._id_index, mid)
+            found = self._string_bytes(QUESTION.unpack_from(self._map, self._question_table + QUESTION.size * number)[0])
+            if found == key:
+                return number
+            if found < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def get(self, question_id):
+        """Decode one question by id, or None if there isn't one."""
+        number = self._find(question_id)
+        return None if number is None else self._question(number)
+
+    def _sample(self, n, category, difficulty, repeat):
+        index, lo, hi = self._range(category, difficulty)
+        served = () if repeat else self._served
+        # Drawing enough extra positions to cover every served question still leaves n that weren't
+        positions = self.rng.sample(range(lo, hi), min(n + len(served), hi - lo))
+        numbers = []
+        for position in positions:
+            number = self._entry(index, position)
+            if number not in served:
+                numbers.append(number)
+                if len(numbers) == n:
+                    break
+        return numbers
+
+    def sample(self, n, category=None, difficulty=None, repeat=False):
+        """Up to n question ids picked at random, see QuestionBank.sample."""
+        return [self._string(QUESTION.unpack_from(self._map, self._question_table + QUESTION.size * number)[0])
+                for number in self._sample(n, category, difficulty, repeat)]
+
+    # -----------------------------
+    # SERVING
+    # -----------------------------
+
+    def serve(self, question):
+        """Shuffle a question (or question id) onto the buttons, see shuffle_answers, and mark it served."""
+        if isinstance(question, Question):
+            number = self._find(question.id)
+        else:
+            number = self._find(question)
+            question = self._question(number)
+        self._served.add(number)
+        return shuffle_answers(question, self.rng)
+
+    def deal(self, n, category=None, difficulty=None, repeat=False):
+        """Pick n questions and yield them one at a time, each decoded and shuffled only when it is reached."""
+        for number in self._sample(n, category, difficulty, repeat):
+            self._served.add(number)
+            yield shuffle_answers(self._question(number), self.rng)
+
+    def reset(self):
+        """Forget which questions have been served."""
+        self._served.clear()
+
+
+def pack_path(path):
+    """Where the pack built from a question file goes."""
+    return os.path.splitext(path)[0] + PACK_SUFFIX
+
+
+def open_questions(path, rng=None):
+    """
+    The questions in path: its pack if one has been built since the file last changed,
+    otherwise the file itself through QuestionBank. path can also be a pack.
+    """
+    if path.endswith(PACK_SUFFIX):
+        return QuestionPack(path, rng)
+    pack = pack_path(path)
+    if os.path.exists(pack) and (not os.path.exists(path) or os.path.getmtime(pack) >= os.path.getmtime(path)):
+        return QuestionPack(pack, rng)
+    return QuestionBank(path, rng=rng)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile question files into a question pack")
+    parser.add_argument("sources", nargs="+", help="JSON Lines or CSV question files")
+    parser.add_argument("-o", "--output", help="pack to write (default: the first source with %s)" % PACK_SUFFIX)
+    args = parser.parse_args(argv)
+
+    output = args.output or pack_path(args.sources[0])
+    try:
+        count = build_pack(args.sources, output)
+    except (QuestionBankError, OSError) as e:
+        print("Could not build %s: %s" % (output, e), file=sys.stderr)
+        return 1
+    with QuestionPack(output) as pack:
+        print("Wrote %s: %d questions in %d categories, %d bytes"
+              % (output, count, len(pack.categories()), os.path.getsize(output)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+import random
+import time
+from collections import namedtuple
+
+from BuzzArbiter import BuzzArbiter
+from BuzzController import CONNECTED, CONTROLLERS_PER_DEVICE, DECISION_LATENCY, DISCONNECTED
+import Metrics
+
+# What a session reports back as it goes, for a front end to show:
+#   QUESTION  detail is the served question dict (see QuestionBank.shuffle_answers)
+#   BUZZED    player won the buzz-in, detail is the BuzzResult
+#   CORRECT   player answered right, detail is the button
+#   WRONG     player answered wrong and is out of this question, detail is the button
+#   TIMED_OUT player didn't answer in time and is out of this question, detail is None
+#   SKIPPED   everybody is out, detail is the correct button
+#   FINISHED  no questions left, detail is the scores
+Outcome = namedtuple("Outcome", ["kind", "question", "player", "detail"])
+
+QUESTION = "question"
+BUZZED = "buzzed"
+CORRECT = "correct"
+WRONG = "wrong"
+TIMED_OUT = "timed_out"
+SKIPPED = "skipped"
+FINISHED = "finished"
+
+# Where a session is up to
+BUZZING = "buzzing"
+ANSWERING = "answering"
+DONE = "done"
+
+
+class QuizSession:
+    """
+    The quiz flow from quizGame.py for one room, with no globals, devices or screen:
+    players buzz in on red, the winner answers with a colour, a wrong answer takes that
+    player and answer out and the rest buzz again. With answer_timeout_ms, a player who
+    doesn't answer in time is out too, though their time stands still while their
+    dongle is unplugged.
+
+    Feed it button events (from a BuzzController, BuzzManager, a replayed log or bots)
+    with on_event, and call on_time when next_deadline_ns passes (straight away once
+    the queued events are in, with no tie window); both return the Outcomes that
+    happened. Buzz-ins are decided by event timestamps, so the same events always
+    give the same game (given the same rng).
+
+        session = QuizSession(bank.deal(10), num_players=4)
+        outcomes = session.start()
+        ...
+        outcomes = session.on_event(buzz.get_event())
+    """
+
+    def __init__(self, questions, num_players=4, buzz_button="red", tie_window_ms=0.0, tie_break="random",
+                 rng=None, answer_timeout_ms=None):
+        self.num_players = num_players
+        self.buzz_button = buzz_button
+        self.tie_window_ms = tie_window_ms
+        self.tie_break = tie_break
+        self.answer_timeout_ms = answer_timeout_ms
+        self.rng = rng if rng is not None else random.Random()
+        self.scores = [0] * num_players
+        # Time from each winning press to the decision, in nanoseconds
+        self.decision_latencies_ns = []
+        self.questions_asked = 0
+        self.phase = None
+        self.question = None
+        self.answering = None
+        self.available_players = []
+        self.available_answers = []
+
+        self._questions = iter(questions)
+        self._arbiter = None
+        self._closes_ns = None
+        self._started_ns = 0
+        # First controller of each dongle that is unplugged (what DISCONNECTED events carry)
+        self._disconnected = set()
+        # Answer time that was left when the answering player's dongle was unplugged
+        self._paused_ns = None
+
+    @property
+    def finished(self):
+        return self.phase == DONE
+
+    def start(self, now_ns=None):
+        """Ask the first question. Presses stamped before now_ns don't count for it."""
+        return self._next_question(time.monotonic_ns() if now_ns is None else now_ns)
+
+    def next_deadline_ns(self):
+        """When on_time needs calling next (the tie window closing or the answer time running out), or None."""
+        return self._closes_ns
+
+    # -----------------------------
+    # INPUT
+    # -----------------------------
+
+    def on_event(self, event, now_ns=None):
+        """Take one button event. Returns the Outcomes it caused."""
+        if event.button == DISCONNECTED:
+            self._disconnected.add(event.controller)
+            self._pause_answer(event.timestamp_ns)
+            return []
+        if event.button == CONNECTED:
+            self._disconnected.discard(event.controller)
+            self._resume_answer(event.timestamp_ns)
+            return []
+        if not event.pressed or event.timestamp_ns < self._started_ns:
+            # Releases, and presses from before this part of the question, don't count
+            return []
+
+        if self._closes_ns is not None and event.timestamp_ns > self._closes_ns:
+            # The tie window closed, or the answer time ran out, before this press: that happens first
+            outcomes = self._decide(now_ns) if self.phase == BUZZING else self._time_out()
+            return outcomes + self.on_event(event, now_ns)
+
+        if self.phase == BUZZING:
+            # Not decided here even with no tie window: presses from the same report (or with the
+            # same timestamp) may still be coming, so it waits for a later press or on_time
+            if self._arbiter.offer(event) and self._closes_ns is None:
+                self._closes_ns = self._arbiter.window_closes_ns()
+            return []
+
+        if self.phase == ANSWERING and event.controller == self.answering:
+            if event.button in self.available_answers:
+                return self._answer(event, now_ns)
+        return []
+
+    def on_time(self, now_ns=None):
+        """Close the tie window or end the answer time if it is due. Returns the Outcomes that caused."""
+        if now_ns is None:
+            now_ns = time.monotonic_ns()
+        if self._closes_ns is None or now_ns < self._closes_ns:
+            return []
+        if self.phase == BUZZING:
+            return self._decide(now_ns)
+        return self._time_out()
+
+    def _answerer_unplugged(self):
+        return (self.phase == ANSWERING and
+                self.answering - self.answering % CONTROLLERS_PER_DEVICE in self._disconnected)
+
+    def _pause_answer(self, now_ns):
+        # The game waits for a dongle that was unplugged, so its player's answer time does too
+        if self._closes_ns is not None and self._answerer_unplugged():
+            self._paused_ns = max(0, self._closes_ns - now_ns)
+            self._closes_ns = None
+
+    def _resume_answer(self, now_ns):
+        if self._paused_ns is not None and not self._answerer_unplugged():
+            self._closes_ns = now_ns + self._paused_ns
+            self._paused_ns = None
+
+    # -----------------------------
+    # FLOW
+    # -----------------------------
+
+    def _next_question(self, now_ns):
+        self.question = next(self._questions, None)
+        if self.question is None:
+            self.phase = DONE
+            self._closes_ns = None
+            return [Outcome(FINISHED, None, None, list(self.scores))]
+        self.questions_asked += 1
+        self.available_players = list(range(self.num_players))
+        self.available_answers = list(self.question["answers"])
+        self._open_buzz(now_ns)
+        return [Outcome(QUESTION, self.question, None, self.question)]
+
+    def _open_buzz(self, now_ns):
+        self.phase = BUZZING
+        self.answering = None
+        self._started_ns = now_ns
+        self._closes_ns = None
+        self._paused_ns = None
+        self._arbiter = BuzzArbiter(self.buzz_button, self.available_players, self.tie_window_ms,
+                                    self.tie_break, self.rng)
+
+    def _decide(self, now_ns):
+        if now_ns is None:
+            now_ns = time.monotonic_ns()
+        result = self._arbiter.decide()
+        latency = now_ns - self._arbiter.first_press_ns()
+        self.decision_latencies_ns.append(latency)
+        if Metrics.ENABLED:
+            DECISION_LATENCY.record(latency)
+        self.phase = ANSWERING
+        self.answering = result.winner
+        self._closes_ns = None
+        if self.answer_timeout_ms is not None:
+            # From when the buzz-in was settled by the presses, so a replay times out in the same place
+            self._closes_ns = self._arbiter.window_closes_ns() + int(self.answer_timeout_ms * 1000000)
+            self._pause_answer(self._arbiter.window_closes_ns())
+        self._started_ns = self._arbiter.first_press_ns()
+        return [Outcome(BUZZED, self.question, result.winner, result)]
+
+    def _answer(self, event, now_ns):
+        # Everything after an answer is timed from the answer's own timestamp, not now_ns,
+        # so a replayed session goes the same however fast it is fed in
+        player = event.controller
+        if event.button == self.question["correct"]:
+            self.scores[player] += 1
+            return [Outcome(CORRECT, self.question, player, event.button)] + self._next_question(event.timestamp_ns)
+
+        self.available_answers.remove(event.button)
+        return self._player_out(Outcome(WRONG, self.question, player, event.button), event.timestamp_ns)
+
+    def _time_out(self):
+        outcome = Outcome(TIMED_OUT, self.question, self.answering, None)
+        return self._player_out(outcome, self._closes_ns)
+
+    def _player_out(self, outcome, now_ns):
+        # The rest buzz again, or if everybody is out, on to the next question
+        outcomes = [outcome]
+        self.available_players.remove(outcome.player)
+        if not self.available_players:
+            outcomes.append(Outcome(SKIPPED, self.question, None, self.question["correct"]))
+            return outcomes + self._next_question(now_ns)
+        self._open_buzz(now_ns)
+        return outcomes
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+
+import pygame
+
+
+class TextCache:
+    """
+    Rendered text surfaces keyed by (font, text, colour), so a label that is drawn every
+    frame is only rasterised once. The least recently used entries go when it is full.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._surfaces = OrderedDict()
+
+    def render(self, font, text, colour, antialias=True):
+        key = (font, text, colour, antialias)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, antialias, colour)
+        self._surfaces[key] = surface
+        if len(self._surfaces) > self.max_entries:
+            self._surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self._surfaces.clear()
+
+
+class DirtyRenderer:
+    """
+    Draws a screen as named regions and only redraws the ones whose state changed,
+    then pushes just those rectangles to the display with pygame.display.update(rects).
+
+        renderer.begin("ready", WHITE)
+        renderer.region("title", (0, 0, WIDTH, 100), title, draw_title)
+        renderer.present()
+
+    draw is called with the region's pygame.Rect and must paint all of it.
+    """
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.frames = 0
+        self.rects_updated = 0
+        self._screen_name = None
+        self._regions = {}
+        self._dirty = []
+        self._full = True
+
+    def invalidate(self):
+        """Redraw everything on the next frame."""
+        self._full = True
+        self._regions.clear()
+
+    def begin(self, screen_name, background):
+        """Start a frame; switching to a different screen clears it and redraws every region."""
+        if screen_name != self._screen_name:
+            self._screen_name = screen_name
+            self.invalidate()
+        if self._full:
+            self.screen.fill(background)
+
+    def region(self, name, rect, state, draw):
+        """Draw the region if it is new, moved, or its state is different from last frame."""
+        rect = pygame.Rect(rect)
+        if self._regions.get(name) == (rect, state):
+            return False
+        self._regions[name] = (rect, state)
+        draw(rect)
+        if not self._full:
+            self._dirty.append(rect)
+        return True
+
+    def present(self):
+        """Push the changed parts of the frame to the display. Returns how many rectangles went."""
+        self.frames += 1
+        if self._full:
+            pygame.display.flip()
+            self._full = False
+            self._dirty = []
+            return 1
+        count = len(self._dirty)
+        if self._dirty:
+            pygame.display.update(self._dirty)
+            self.rects_updated += count
+            self._dirty = []
+        return count
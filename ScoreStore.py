@@ -0,0 +1,292 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+
+class ScoreStore:
+    """
+    Players, games, every answer and how fast it was buzzed in, kept in an SQLite database
+    in WAL mode so reads never wait for the writer.
+
+    Writes are queued and a background thread commits them in batches, so recording an
+    answer costs the game a queue put. Running totals per player are kept up to date as
+    the answers go in, so the leaderboard and a player's accuracy and reaction time are
+    index lookups however many years of games there are.
+
+        store = ScoreStore("scores.db")
+        game = store.start_session({0: "Cam", 1: "Emily"}, questions=10)
+        store.record_answer(game, "Cam", "geo-001", "blue", True, reaction_ms=412.0)
+        store.finish_session(game, {"Cam": 1, "Emily": 0})
+        print(store.leaderboard())
+        store.close()
+    """
+
+    # Most writes committed in one transaction, and how long the writer waits for more to join them
+    BATCH_SIZE = 500
+    BATCH_DELAY = 0.05
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS players (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            created REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            started REAL NOT NULL,
+            finished REAL,
+            questions INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS session_players (
+            session_id TEXT NOT NULL,
+            player_id INTEGER NOT NULL,
+            controller INTEGER,
+            score INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (session_id, player_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS answers (
+            id INTEGER PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            question_id TEXT,
+            player_id INTEGER NOT NULL,
+            button TEXT,
+            correct INTEGER NOT NULL,
+            reaction_ms REAL,
+            answered REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS player_stats (
+            player_id INTEGER PRIMARY KEY,
+            games INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            points INTEGER NOT NULL DEFAULT 0,
+            answers INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            reactions INTEGER NOT NULL DEFAULT 0,
+            reaction_total_ms REAL NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS player_stats_points ON player_stats (points DESC);
+        CREATE INDEX IF NOT EXISTS answers_player ON answers (player_id, answered);
+        CREATE INDEX IF NOT EXISTS answers_session ON answers (session_id);
+        CREATE INDEX IF NOT EXISTS sessions_finished ON sessions (finished);
+        CREATE INDEX IF NOT EXISTS session_players_player ON session_players (player_id);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.writes = 0
+        self.batches = 0
+
+        db = self._connect()
+        db.executescript(self.SCHEMA)
+        db.commit()
+        # Reads come from whichever thread asks, one at a time
+        self._db = db
+        self._read_lock = threading.Lock()
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="ScoreWriter", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps the database consistent without a sync on every commit
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def close(self):
+        """Commit everything queued and close the database."""
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -----------------------------
+    # WRITING
+    # -----------------------------
+
+    def add_players(self, names):
+        """Make sure there is a player for each name."""
+        for name in names:
+            self._queue.put(("player", (name,)))
+
+    def start_session(self, players, questions):
+        """
+        Record a game starting. players is {controller: name}.
+        Returns the session id to record its answers and scores against.
+        """
+        session_id = uuid.uuid4().hex
+        self._queue.put(("start", (session_id, time.time(), dict(players), questions)))
+        return session_id
+
+    def record_answer(self, session_id, name, question_id, button, correct, reaction_ms=None):
+        """
+        Record a player's answer. reaction_ms is how long they took to buzz in
+        after the question went up, if known.
+        """
+        self._queue.put(("answer", (session_id, name, question_id, button, bool(correct), reaction_ms, time.time())))
+
+    def finish_session(self, session_id, scores, best=None):
+        """
+        Record a game's final scores, {name: score}. The highest scores win it; if players
+        who aren't kept (so aren't in scores) took part, best is the top score over everyone.
+        """
+        self._queue.put(("finish", (session_id, time.time(), dict(scores), best)))
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is committed."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _write_loop(self):
+        db = self._connect()
+        player_ids = {}
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.BATCH_DELAY
+            while len(batch) < self.BATCH_SIZE and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            # Stopping and flushing happen whatever becomes of the writes around them
+            running = None not in batch
+            flushed = [item for item in batch if isinstance(item, threading.Event)]
+            writes = [item for item in batch if isinstance(item, tuple)]
+            try:
+                with db:
+                    db.execute("BEGIN")
+                    for item in writes:
+                        # A write that fails is undone on its own, the rest of the batch still goes in
+                        db.execute("SAVEPOINT write")
+                        try:
+                            self._apply(db, player_ids, *item)
+                        except sqlite3.Error:
+                            traceback.print_exc()
+                            db.execute("ROLLBACK TO write")
+                            # Ids it looked up may have been rolled back with it
+                            player_ids.clear()
+                        else:
+                            self.writes += 1
+                        db.execute("RELEASE write")
+            except sqlite3.Error:
+                # The commit failed (the database stayed locked, say) so the whole batch is rolled back;
+                # the game carries on without it
+                traceback.print_exc()
+                player_ids.clear()
+            self.batches += 1
+            for done in flushed:
+                done.set()
+        db.close()
+
+    def _player_id(self, db, player_ids, name):
+        player_id = player_ids.get(name)
+        if player_id is None:
+            db.execute("INSERT OR IGNORE INTO players (name, created) VALUES (?, ?)", (name, time.time()))
+            player_id = db.execute("SELECT id FROM players WHERE name = ?", (name,)).fetchone()[0]
+            db.execute("INSERT OR IGNORE INTO player_stats (player_id) VALUES (?)", (player_id,))
+            player_ids[name] = player_id
+        return player_id
+
+    def _apply(self, db, player_ids, kind, args):
+        # Runs on the writer thread, inside the batch's transaction
+        if kind == "player":
+            self._player_id(db, player_ids, args[0])
+
+        elif kind == "start":
+            session_id, started, players, questions = args
+            db.execute("INSERT INTO sessions (id, started, questions) VALUES (?, ?, ?)",
+                       (session_id, started, questions))
+            db.executemany("INSERT OR IGNORE INTO session_players (session_id, player_id, controller) VALUES (?, ?, ?)",
+                           [(session_id, self._player_id(db, player_ids, name), controller)
+                            for controller, name in players.items()])
+
+        elif kind == "answer":
+            session_id, name, question_id, button, correct, reaction_ms, answered = args
+            player_id = self._player_id(db, player_ids, name)
+            db.execute("INSERT INTO answers (session_id, question_id, player_id, button, correct, reaction_ms, answered)"
+                       " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (session_id, question_id, player_id, button, int(correct), reaction_ms, answered))
+            db.execute("UPDATE player_stats SET answers = answers + 1, correct = correct + ?,"
+                       " reactions = reactions + ?, reaction_total_ms = reaction_total_ms + ? WHERE player_id = ?",
+                       (int(correct), int(reaction_ms is not None), reaction_ms or 0.0, player_id))
+
+        elif kind == "finish":
+            session_id, finished, scores, best = args
+            db.execute("UPDATE sessions SET finished = ? WHERE id = ?", (finished, session_id))
+            if best is None:
+                best = max(scores.values()) if scores else None
+            for name, score in scores.items():
+                player_id = self._player_id(db, player_ids, name)
+                db.execute("INSERT INTO session_players (session_id, player_id, score) VALUES (?, ?, ?)"
+                           " ON CONFLICT (session_id, player_id) DO UPDATE SET score = excluded.score",
+                           (session_id, player_id, score))
+                db.execute("UPDATE player_stats SET games = games + 1, wins = wins + ?, points = points + ?"
+                           " WHERE player_id = ?", (int(score == best and best > 0), score, player_id))
+
+    # -----------------------------
+    # QUERIES
+    # -----------------------------
+
+    def _query(self, sql, params=()):
+        with self._read_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def player_names(self):
+        """Every player's name, in alphabetical order."""
+        return [row[0] for row in self._query("SELECT name FROM players ORDER BY name")]
+
+    def leaderboard(self, limit=10, since=None):
+        """
+        [(name, points, games)], best first. With since (a time.time()), only
+        games finished since then count.
+        """
+        if since is None:
+            return self._query(
+                "SELECT name, points, games FROM player_stats JOIN players ON players.id = player_id"
+                " WHERE games > 0 ORDER BY points DESC LIMIT ?", (limit,))
+        return self._query(
+            "SELECT name, SUM(score) AS total, COUNT(*) FROM sessions"
+            " JOIN session_players ON session_id = sessions.id JOIN players ON players.id = player_id"
+            " WHERE finished >= ? GROUP BY player_id ORDER BY total DESC LIMIT ?", (since, limit))
+
+    def player_stats(self, name):
+        """
+        {"games", "wins", "points", "answers", "correct", "accuracy", "avg_reaction_ms"}
+        for one player, or None if there is no such player.
+        """
+        rows = self._query(
+            "SELECT games, wins, points, answers, correct, reactions, reaction_total_ms"
+            " FROM players JOIN player_stats ON player_id = players.id WHERE name = ?", (name,))
+        if not rows:
+            return None
+        games, wins, points, answers, correct, reactions, reaction_total = rows[0]
+        return {
+            "games": games,
+            "wins": wins,
+            "points": points,
+            "answers": answers,
+            "correct": correct,
+            "accuracy": correct / answers if answers else None,
+            "avg_reaction_ms": reaction_total / reactions if reactions else None,
+        }
+
+
+def default_path():
+    """BUZZ_SCORES, or scores.db next to the game."""
+    return os.environ.get("BUZZ_SCORES") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "scores.db")
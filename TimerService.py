@@ -0,0 +1,218 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+
+class Timer:
+    """A callback scheduled on a TimerService. Cancel, pause and resume it through here."""
+
+    def __init__(self, service, deadline, period, callback, args):
+        self.service = service
+        self.deadline = deadline
+        self.period = period
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        # Seconds that were left when it was paused, None while it is running
+        self.paused_remaining = None
+        # Bumped every time it is rescheduled, so the heap entries from before are skipped
+        self._generation = 0
+
+    @property
+    def active(self):
+        return not self.cancelled
+
+    @property
+    def paused(self):
+        return self.paused_remaining is not None
+
+    def remaining(self, now=None):
+        """Seconds until it fires (0 once due), frozen while paused."""
+        if self.paused:
+            return self.paused_remaining
+        if now is None:
+            now = self.service.clock()
+        return max(0.0, self.deadline - now)
+
+    def cancel(self):
+        self.service._cancel(self)
+
+    def pause(self):
+        self.service._pause(self)
+
+    def resume(self):
+        self.service._resume(self)
+
+
+class TimerService:
+    """
+    Every countdown, deadline and repeating tick on one heap, ordered by time.monotonic().
+
+    Drive it from a game loop (wait at most next_delay(), then call run_due()), or start()
+    one thread to do that. Either way there is no thread per timer, and a timer fires
+    within a millisecond or so of its deadline. Repeating timers are scheduled from their
+    last deadline, not from when they ran, so they don't drift.
+
+        timers = TimerService()
+        countdown = timers.call_later(5, go)
+        countdown.pause()
+        ...
+        countdown.resume()
+        timers.run_due()
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.fired = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    # -----------------------------
+    # SCHEDULING
+    # -----------------------------
+
+    def call_at(self, deadline, callback, *args):
+        """Call callback(*args) once at deadline (a clock() time)."""
+        return self._schedule(Timer(self, deadline, None, callback, args))
+
+    def call_later(self, delay, callback, *args):
+        """Call callback(*args) once, delay seconds from now."""
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def call_every(self, period, callback, *args, first=None):
+        """Call callback(*args) every period seconds, the first time after first (default period) seconds."""
+        timer = Timer(self, self.clock() + (period if first is None else first), period, callback, args)
+        return self._schedule(timer)
+
+    def _schedule(self, timer):
+        with self._cond:
+            timer._generation += 1
+            heapq.heappush(self._heap, (timer.deadline, next(self._seq), timer._generation, timer))
+            # The thread may be waiting for something later
+            self._cond.notify()
+        return timer
+
+    def _cancel(self, timer):
+        with self._cond:
+            timer.cancelled = True
+            timer._generation += 1
+
+    def _pause(self, timer):
+        with self._cond:
+            if timer.cancelled or timer.paused:
+                return
+            timer.paused_remaining = max(0.0, timer.deadline - self.clock())
+            timer._generation += 1
+
+    def _resume(self, timer):
+        with self._cond:
+            if timer.cancelled or not timer.paused:
+                return
+            timer.deadline = self.clock() + timer.paused_remaining
+            timer.paused_remaining = None
+        self._schedule(timer)
+
+    # -----------------------------
+    # RUNNING
+    # -----------------------------
+
+    def _pop_stale(self):
+        # Drop heap entries for timers that were cancelled, paused or rescheduled since
+        heap = self._heap
+        while heap and heap[0][2] != heap[0][3]._generation:
+            heapq.heappop(heap)
+
+    def next_deadline(self):
+        """When the next timer is due, or None if none are."""
+        with self._cond:
+            self._pop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def next_delay(self, limit=None):
+        """Seconds until the next timer is due (0 if one already is), at most limit."""
+        deadline = self.next_deadline()
+        if deadline is None:
+            return limit
+        delay = max(0.0, deadline - self.clock())
+        return delay if limit is None else min(delay, limit)
+
+    def run_due(self, now=None):
+        """Fire every timer that is due. Returns how many fired."""
+        if now is None:
+            now = self.clock()
+        fired = 0
+        while True:
+            with self._cond:
+                self._pop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                deadline, _, _, timer = heapq.heappop(self._heap)
+                if timer.period is None:
+                    timer.cancelled = True
+                else:
+                    timer.deadline = deadline + timer.period
+                    if timer.deadline <= now:
+                        # Fell more than a period behind, skip the missed ticks rather than bunching them
+                        timer.deadline = now + timer.period
+                    timer._generation += 1
+                    heapq.heappush(self._heap, (timer.deadline, next(self._seq), timer._generation, timer))
+            # Outside the lock, so callbacks can schedule and cancel
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                traceback.print_exc()
+            fired += 1
+        self.fired += fired
+        return fired
+
+    def start(self):
+        """Run the timers on one background thread."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="BuzzTimers", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                self._pop_stale()
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - self.clock()
+                if delay > 0:
+                    # Woken early when something sooner is scheduled
+                    self._cond.wait(delay)
+                    continue
+            self.run_due()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_service():
+    """The TimerService with its own thread that anything without a game loop (like LightAnimator) shares."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = TimerService()
+            _shared.start()
+        return _shared
@@ -0,0 +1,447 @@
+"""
+Buzz-in latency and throughput benchmarks.
+
+    python benchmark.py                       # virtual device, results as JSON on stdout
+    python benchmark.py --output run.json --compare baseline.json
+    python benchmark.py --device hid          # real dongle (latency needs someone pressing red)
+    python benchmark.py --replay session.log  # also time a recorded session (see BuzzLog.py)
+
+Modes:
+  busy-poll:   no reader thread, controller_get_first_pressed spins on get_state()
+  event-queue: the reader thread queues events and the caller blocks on them
+  asyncio:     the reader thread hands events to an event loop, the caller awaits them
+  remote:      a separate input process owns the dongle and events come back through shared
+               memory (BuzzRemote); its CPU time is not in cpu_percent, which is the game's
+"""
+import argparse
+import asyncio
+import bisect
+import functools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import BuzzBackend
+import BuzzLog
+from AudioCues import AudioCues
+from BuzzAsync import AsyncBuzzController
+from BuzzController import BuzzController
+from BuzzRemote import RemoteBuzz
+
+MODES = ["busy-poll", "event-queue", "asyncio", "remote"]
+
+# Metrics where a bigger number is worse, used by --compare
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "max_ms", "cpu_percent")
+# Changes smaller than this are scheduler noise, not regressions
+NOISE_FLOOR = {"_ms": 1.0, "cpu_percent": 2.0}
+
+
+# -----------------------------
+# HELPERS
+# -----------------------------
+
+def percentiles(samples_ns):
+    """p50/p99/max in milliseconds of a list of nanosecond samples."""
+    if not samples_ns:
+        return {"count": 0}
+    ordered = sorted(samples_ns)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] / 1e6
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] / 1e6,
+    }
+
+
+class RenderLoad:
+    """Keeps the interpreter busy the way a rendering game loop would, to see how input suffers."""
+
+    def __init__(self, frame_ms=20):
+        self.frame_ms = frame_ms
+        self._running = False
+        self._thread = None
+
+    def __enter__(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._running = False
+        self._thread.join()
+
+    def _run(self):
+        while self._running:
+            end = time.perf_counter() + self.frame_ms / 1000
+            total = 0
+            while time.perf_counter() < end:
+                total += sum(range(200))
+            time.sleep(1 / 60)
+
+
+def virtual_backends(timeline, start_ns=None):
+    """One virtual dongle playing timeline from start_ns, opened in the remote mode's input process."""
+    device = BuzzBackend.VirtualBuzzDevice()
+    device.schedule(timeline, start_ns)
+    return [device]
+
+
+def open_controller(args, mode, timeline=(), realtime=True):
+    """
+    A BuzzController for the mode, plus the virtual device behind it (None on real hardware,
+    and for the remote mode, where the device is in the other process).
+    """
+    if mode == "remote":
+        if args.device == "hid":
+            return RemoteBuzz(), None
+        return RemoteBuzz(functools.partial(virtual_backends, list(timeline))), None
+    if args.device == "hid":
+        device = None
+        buzz = BuzzController(start_reader=(mode != "busy-poll"))
+    else:
+        device = BuzzBackend.VirtualBuzzDevice(timeline, realtime=realtime)
+        buzz = BuzzController(start_reader=(mode != "busy-poll"), backend=device)
+    return buzz, device
+
+
+# -----------------------------
+# BENCHMARKS
+# -----------------------------
+
+def bench_latency(args, mode):
+    """Time from a report landing until controller_get_first_pressed returns."""
+    if mode == "asyncio":
+        return asyncio.run(bench_latency_async(args))
+    if mode == "remote":
+        return bench_latency_remote(args)
+    buzz, device = open_controller(args, mode)
+    if device is None and mode == "busy-poll":
+        # Without the reader thread there is no report timestamp to measure from
+        buzz.close()
+        return percentiles([])
+    rng = random.Random(args.seed)
+    samples = []
+    try:
+        for _ in range(args.trials):
+            if device is not None:
+                controller = rng.randrange(4)
+                delay = rng.uniform(0.002, 0.010)
+                device.schedule(BuzzBackend.timeline_from_presses([(delay, controller, "red", 0.02)]),
+                                time.monotonic_ns())
+                buzz.controller_get_first_pressed("red", timeout=1)
+                samples.append(time.monotonic_ns() - device.last_due_ns)
+                time.sleep(0.03)
+            else:
+                # No landing time from real hardware, use the reader's stamp instead
+                buzz.drain_events()
+                event = buzz.wait_for_press(buttons=("red",), timeout=30)
+                if event is not None:
+                    samples.append(time.monotonic_ns() - event.timestamp_ns)
+    finally:
+        buzz.close()
+    return percentiles(samples)
+
+
+async def bench_latency_async(args):
+    """Time from a report landing until AsyncBuzzController.first_pressed returns."""
+    buzz, device = open_controller(args, "asyncio")
+    rng = random.Random(args.seed)
+    samples = []
+    async with AsyncBuzzController(buzz) as abuzz:
+        for _ in range(args.trials):
+            if device is not None:
+                controller = rng.randrange(4)
+                delay = rng.uniform(0.002, 0.010)
+                device.schedule(BuzzBackend.timeline_from_presses([(delay, controller, "red", 0.02)]),
+                                time.monotonic_ns())
+                await abuzz.first_pressed("red", timeout=1)
+                samples.append(time.monotonic_ns() - device.last_due_ns)
+                await asyncio.sleep(0.03)
+            else:
+                event = await abuzz.wait_for_press(buttons=("red",), timeout=30)
+                if event is not None:
+                    samples.append(time.monotonic_ns() - event.timestamp_ns)
+    return percentiles(samples)
+
+
+def bench_latency_remote(args):
+    """Time from a report landing in the input process until the game process reads the press."""
+    if args.device == "hid":
+        buzz = RemoteBuzz()
+        samples = []
+        try:
+            for _ in range(args.trials):
+                event = buzz.wait_for_press(buttons=("red",), timeout=30)
+                if event is not None:
+                    samples.append(time.monotonic_ns() - event.timestamp_ns)
+        finally:
+            buzz.close()
+        return percentiles(samples)
+
+    # The device is in the other process, so the presses are all scheduled up front
+    rng = random.Random(args.seed)
+    presses = []
+    at = 0.0
+    for _ in range(args.trials):
+        at += rng.uniform(0.03, 0.04)
+        presses.append((at, rng.randrange(4), "red", 0.02))
+    start_ns = time.monotonic_ns() + int(1e9)
+    due = [start_ns + int(press[0] * 1e9) for press in presses]
+
+    buzz = RemoteBuzz(functools.partial(virtual_backends, BuzzBackend.timeline_from_presses(presses), start_ns))
+    # Reports that were due before the input process was up don't count
+    ready_ns = time.monotonic_ns()
+    samples = []
+    try:
+        while True:
+            # The first press is still a second or so off, however quickly the input process came up
+            timeout = 1 if samples else max(0, due[0] - time.monotonic_ns()) / 1e9 + 1
+            event = buzz.wait_for_press(buttons=("red",), timeout=timeout)
+            if event is None:
+                break
+            # Presses are 30ms apart, so the one behind an event is the last that was due before its stamp
+            landed = due[max(0, bisect.bisect_right(due, event.timestamp_ns) - 1)]
+            if landed >= ready_ns:
+                samples.append(time.monotonic_ns() - landed)
+    finally:
+        buzz.close()
+    return percentiles(samples)
+
+
+def bench_decode(args):
+    """How many reports a second get_button_status and read_all can get through."""
+    reports = args.reports
+    rng = random.Random(args.seed)
+    timeline = [(0, rng.getrandbits(20)) for _ in range(reports)]
+
+    device = BuzzBackend.VirtualBuzzDevice(timeline, realtime=False)
+    buzz = BuzzController(start_reader=False, backend=device)
+    start = time.perf_counter()
+    for _ in range(reports):
+        # What get_button_status does, one report at a time (on its own it would drain them all at once)
+        state, _ = buzz.read_all(max_reports=1)
+        state.to_dicts(buzz.num_players)
+    status_elapsed = time.perf_counter() - start
+    buzz.close()
+
+    device = BuzzBackend.VirtualBuzzDevice(timeline, realtime=False)
+    buzz = BuzzController(start_reader=False, backend=device)
+    start = time.perf_counter()
+    buzz.read_all()
+    drain_elapsed = time.perf_counter() - start
+    buzz.close()
+
+    return {
+        "reports": reports,
+        "get_button_status_per_sec": reports / status_elapsed,
+        "read_all_per_sec": reports / drain_elapsed,
+    }
+
+
+def bench_replay(args):
+    """How fast a recorded session goes through BuzzController's reader thread when replayed flat out."""
+    backend = BuzzLog.ReplayBackend(args.replay, realtime=False)
+    events = []
+    buzz = BuzzController(start_reader=False, backend=backend)
+    buzz.queue_events = False
+    buzz.add_listener(events.append)
+    start = time.perf_counter()
+    buzz.start_reader()
+    backend.finished.wait()
+    elapsed = time.perf_counter() - start
+    buzz.close()
+    return {
+        "reports": backend.reports_sent,
+        "events": len(events),
+        "reports_per_sec": backend.reports_sent / elapsed if elapsed else 0.0,
+    }
+
+
+def bench_audio(args):
+    """Time from a report landing to its cue being handed to the mixer, with the cue bound to red presses."""
+    # The latency up to the mixer doesn't depend on a sound card being there
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    cues = AudioCues()
+    if not cues.enabled:
+        return {"count": 0}
+    presses = [(0.1 + i * 0.03, i % 4, "red", 0.02) for i in range(args.trials)]
+    buzz, device = open_controller(args, "event-queue", BuzzBackend.timeline_from_presses(presses))
+    cues.bind(buzz, {"red": "buzz"})
+    try:
+        time.sleep(presses[-1][0] + 0.1 if device is not None else args.duration)
+    finally:
+        buzz.close()
+        cues.close()
+    result = percentiles(list(cues.latencies_ns))
+    result["mixer_buffer_ms"] = cues.output_latency_ms
+    return result
+
+
+def bench_leds(args):
+    """USB writes a second from light_set, and how well commit_lights coalesces a 30fps update loop."""
+    buzz, device = open_controller(args, "busy-poll")
+    try:
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < args.duration / 2:
+            buzz.light_set(count % 4, count % 8 < 4)
+            count += 1
+        raw_elapsed = time.perf_counter() - start
+        raw_writes = buzz.led_writes
+
+        commits_before = buzz.led_commits
+        writes_before = buzz.led_writes
+        frames = int(30 * args.duration / 2)
+        for frame in range(frames):
+            # Same pattern as the simple.py screens: four LEDs, one changing twice a second
+            buzz.stage_lights([True, (frame // 15) % 2 == 0, False, True])
+            buzz.commit_lights()
+            time.sleep(1 / 30)
+        commits = buzz.led_commits - commits_before
+        writes = buzz.led_writes - writes_before
+    finally:
+        buzz.close()
+    return {
+        "light_set_writes_per_sec": raw_writes / raw_elapsed,
+        "frames_committed": commits,
+        "frames_written": writes,
+        "coalescing_ratio": commits / writes if writes else None,
+    }
+
+
+def bench_cpu(args, mode):
+    """CPU used while waiting for buzz-ins that arrive a few times a second."""
+    presses = [(0.25 * (i + 1), i % 4, "red", 0.05) for i in range(int(args.duration * 4))]
+    buzz, device = open_controller(args, mode, BuzzBackend.timeline_from_presses(presses))
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    if mode == "asyncio":
+        asyncio.run(_wait_async(buzz, args.duration))
+    else:
+        try:
+            while time.perf_counter() - wall_start < args.duration:
+                buzz.controller_get_first_pressed("red", timeout=args.duration)
+                time.sleep(0.06)
+        finally:
+            buzz.close()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    return {"cpu_percent": 100 * cpu / wall}
+
+
+async def _wait_async(buzz, duration):
+    async with AsyncBuzzController(buzz) as abuzz:
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            await abuzz.first_pressed("red", timeout=duration)
+            await asyncio.sleep(0.06)
+
+
+# -----------------------------
+# RUNNING AND COMPARING
+# -----------------------------
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = {"latency": {}, "latency_under_render": {}, "cpu": {}}
+    for mode in args.modes:
+        results["latency"][mode] = bench_latency(args, mode)
+        with RenderLoad():
+            results["latency_under_render"][mode] = bench_latency(args, mode)
+        results["cpu"][mode] = bench_cpu(args, mode)
+    results["decode"] = bench_decode(args)
+    results["leds"] = bench_leds(args)
+    results["audio"] = bench_audio(args)
+    if args.replay:
+        results["replay"] = bench_replay(args)
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "device": args.device,
+        "time": time.time(),
+        "results": results,
+    }
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline, current, tolerance):
+    """Names of the metrics that got worse by more than tolerance (a fraction)."""
+    old = flatten(baseline["results"])
+    new = flatten(current["results"])
+    regressions = []
+    for name, value in sorted(new.items()):
+        if name not in old or not old[name]:
+            continue
+        change = (value - old[name]) / old[name]
+        worse = change > tolerance if name.endswith(LOWER_IS_BETTER) else change < -tolerance
+        for suffix, floor in NOISE_FLOOR.items():
+            if name.endswith(suffix) and abs(value - old[name]) < floor:
+                worse = False
+        if name.endswith("_per_sec") or name.endswith(LOWER_IS_BETTER):
+            print("%-50s %12.3f -> %12.3f (%+.1f%%)%s" % (name, old[name], value, change * 100,
+                                                           "  REGRESSION" if worse else ""),
+                  file=sys.stderr)
+            if worse:
+                regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--device", choices=["virtual", "hid"], default="virtual")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--trials", type=int, default=200, help="buzz-ins per latency run")
+    parser.add_argument("--reports", type=int, default=100000, help="reports per decode run")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per CPU/LED run")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--replay", help="a recorded session log to replay as fast as possible")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before failing")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
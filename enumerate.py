@@ -1,7 +1,18 @@
+import sys
+
 import hid
 
-for d in hid.enumerate():
+from BuzzProtocol import PRODUCT_ID, VENDOR_ID
+
+# Only the Buzz dongles by default, asking hidapi to filter rather than walking every device.
+# --all lists everything that is plugged in
+if "--all" in sys.argv[1:]:
+    devices = hid.enumerate()
+else:
+    devices = hid.enumerate(VENDOR_ID, PRODUCT_ID)
+
+for d in devices:
     keys = list(d.keys())
     keys.sort()
     for key in keys:
-        print("%s : %s" % (key, d[key]))
\ No newline at end of file
+        print("%s : %s" % (key, d[key]))
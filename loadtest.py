@@ -0,0 +1,222 @@
+"""
+Load test: many quiz rooms at once, played by bots instead of controllers.
+
+    python loadtest.py                                   # 200 sessions, 100 at a time, one process
+    python loadtest.py --sessions 2000 --concurrency 500 --processes 4
+    python loadtest.py --reaction-ms 5 --tie-window-ms 20 --output load.json
+
+Every session is a QuizSession (see QuizSession.py) on an asyncio event loop. Its bots
+press red after a random reaction time and the winner answers after another one, right
+with --accuracy. Presses are stamped when the bot meant to make them, so decision latency
+(press to buzz-in decided) is the tie window plus however far behind the loop is
+running. --processes splits the sessions over that many worker processes, each with
+its own loop and question bank.
+Results are JSON: sessions per second and percentiles of the decision latency, and who
+won buzz-ins pressed in the same report (which should be a tie, settled fairly, every time).
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+
+from benchmark import git_revision, percentiles
+from BuzzController import ButtonEvent
+from QuestionPack import open_questions
+from QuizSession import BUZZING, QuizSession
+
+QUESTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions.jsonl")
+
+
+class BotRoom:
+    """One session and the bots playing it, on the running event loop."""
+
+    def __init__(self, questions, args, rng):
+        self.args = args
+        self.rng = rng
+        self.session = QuizSession(questions, args.players, tie_window_ms=args.tie_window_ms, rng=rng)
+        self.done = asyncio.get_running_loop().create_future()
+        self._seq = 0
+        self._stage = None
+        self._bots = []
+        self._timer = None
+
+    async def play(self):
+        self._handle(self.session.start())
+        await self.done
+        return self.session
+
+    async def _react(self):
+        """Wait a reaction time, spread around the mean and never instant. Returns when it was due."""
+        mean = self.args.reaction_ms / 1000.0
+        delay = max(0.001, self.rng.gauss(mean, mean / 4))
+        due = time.monotonic_ns() + int(delay * 1e9)
+        await asyncio.sleep(delay)
+        return due
+
+    def _press(self, player, button, timestamp_ns):
+        self._seq += 1
+        event = ButtonEvent(timestamp_ns, self._seq, player, button, True)
+        self._handle(self.session.on_event(event, time.monotonic_ns()))
+
+    def _handle(self, outcomes):
+        session = self.session
+        if session.finished:
+            self._cancel()
+            if not self.done.done():
+                self.done.set_result(session)
+            return
+
+        # A new round of buzzing or a new player answering: the old bots have nothing left to do
+        stage = (session.questions_asked, session.phase, len(session.available_players))
+        if stage != self._stage:
+            self._stage = stage
+            self._cancel()
+            if session.phase == BUZZING:
+                self._bots = [asyncio.ensure_future(self._buzz(player)) for player in session.available_players]
+            else:
+                self._bots = [asyncio.ensure_future(self._answer(session.answering))]
+
+        if self._timer is None and session.next_deadline_ns() is not None:
+            delay = max(0, session.next_deadline_ns() - time.monotonic_ns()) / 1e9
+            self._timer = asyncio.get_running_loop().call_later(delay, self._window_closed)
+
+    def _window_closed(self):
+        self._timer = None
+        self._handle(self.session.on_time())
+
+    def _cancel(self):
+        for bot in self._bots:
+            bot.cancel()
+        self._bots = []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def _buzz(self, player):
+        due = await self._react()
+        self._press(player, "red", due)
+
+    async def _answer(self, player):
+        due = await self._react()
+        question = self.session.question
+        if self.rng.random() < self.args.accuracy:
+            button = question["correct"]
+        else:
+            wrong = [b for b in self.session.available_answers if b != question["correct"]]
+            button = self.rng.choice(wrong) if wrong else question["correct"]
+        self._press(player, button, due)
+
+
+async def run_sessions(count, args, seed):
+    """Play count sessions, at most args.concurrency at once."""
+    rng = random.Random(seed)
+    bank = open_questions(args.questions_file, rng)
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        async with limit:
+            questions = list(bank.deal(args.questions, repeat=True))
+            return await BotRoom(questions, args, random.Random(rng.random())).play()
+
+    try:
+        return await asyncio.gather(*[one() for _ in range(count)])
+    finally:
+        bank.close()
+
+
+def same_report_ties(trials, seed):
+    """
+    Buzz-ins where controllers 0 and 1 press red in the same report, fed in report order:
+    {"tied": how many came out as a tie, "wins": {controller: how many it won}}.
+    """
+    rng = random.Random(seed)
+    tied = 0
+    wins = {0: 0, 1: 0}
+    question = {"id": "tie", "question": "", "answers": ["blue"], "correct": "blue", "blue": ""}
+    for _ in range(trials):
+        session = QuizSession([question], 2, rng=random.Random(rng.random()))
+        session.start(0)
+        for controller in (0, 1):
+            session.on_event(ButtonEvent(100, 1, controller, "red", True), 100)
+        buzzed = session.on_time(100)[0].detail
+        tied += buzzed.tied == [0, 1]
+        wins[buzzed.winner] += 1
+    return {"tied": tied, "wins": wins}
+
+
+def run_shard(count, args, seed):
+    """Worker process entry: (decision latencies, questions asked, seconds taken)."""
+    start = time.perf_counter()
+    sessions = asyncio.run(run_sessions(count, args, seed))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for session in sessions for latency in session.decision_latencies_ns]
+    return latencies, sum(session.questions_asked for session in sessions), elapsed
+
+
+def run(args):
+    shards = [args.sessions // args.processes + (1 if n < args.sessions % args.processes else 0)
+              for n in range(args.processes)]
+    start = time.perf_counter()
+    if args.processes == 1:
+        results = [run_shard(shards[0], args, args.seed)]
+    else:
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(run_shard, [(count, args, args.seed + n) for n, count in enumerate(shards)])
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for shard in results for latency in shard[0]]
+    questions = sum(shard[1] for shard in results)
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.time(),
+        "settings": {name: value for name, value in vars(args).items() if name != "output"},
+        "results": {
+            "sessions": args.sessions,
+            "questions": questions,
+            "elapsed_sec": elapsed,
+            "sessions_per_sec": args.sessions / elapsed,
+            "questions_per_sec": questions / elapsed,
+            "decision_latency": percentiles(latencies),
+            "same_report_ties": same_report_ties(200, args.seed),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200, help="sessions to play in total")
+    parser.add_argument("--concurrency", type=int, default=100, help="sessions running at once per process")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes to split the sessions over")
+    parser.add_argument("--players", type=int, default=4, help="bots per session")
+    parser.add_argument("--questions", type=int, default=10, help="questions per session")
+    parser.add_argument("--questions-file", default=QUESTIONS_FILE)
+    parser.add_argument("--reaction-ms", type=float, default=20.0, help="mean bot reaction time")
+    parser.add_argument("--accuracy", type=float, default=0.7, help="chance a bot answers right")
+    parser.add_argument("--tie-window-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    ties = report["results"]["same_report_ties"]
+    if ties["tied"] != sum(ties["wins"].values()) or 0 in ties["wins"].values():
+        print("Presses in the same report were not treated as a tie", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,61 +1,149 @@
 from __future__ import print_function
-import BuzzController
+from AudioCues import AudioCues
+from BuzzController import CONNECTED, DISCONNECTED
+from BuzzManager import BuzzManager
+from QuestionPack import open_questions
+from QuizSession import BUZZED, BUZZING, CORRECT, FINISHED, QUESTION, SKIPPED, TIMED_OUT, WRONG, QuizSession
+from ScoreStore import ScoreStore, default_path
+import Metrics
+import os
+import random
+import sys
 import time
-import _thread
-from random import shuffle
-
-import_questions = [
-    {"question":"What is the capital of Australia", "answers" : ["Canberra", "Sydney", "Hobart", "Melbourne"]},
-    {"question":"What is the capital of Japan", "answers" : ["Tokyo", "Horoshima", "Osaka", "Kyoto"]},
-]
-questions = []
-score = [0, 0, 0, 0]
-
-for question in import_questions:
-    buttons = ["blue", "orange", "green", "yellow"]
-    new_answer = {}
-    shuffle(buttons)
-    new_answer['question'] = question['question']
-    for i in range(4):
-        if i == 0:
-             new_answer["correct"] = buttons[i]
-        new_answer[buttons[i]] = question["answers"][i]
-    questions.append(new_answer)
-
-buzz = BuzzController.BuzzController()
-
-for question in questions:
-    question_answered = False
-    available_answers = ["Blue", "Orange", "Green", "Yellow"]
-    available_controllers = [0, 1, 2, 3]
-
-    while not question_answered:
-        print(question["question"])
-
-        for i in available_answers:
-            print(i + " " + question[i.lower()])
-
-        _thread.start_new_thread(buzz.light_blink, (available_controllers,))
-        controller = buzz.controller_get_first_pressed("red", available_controllers)
-        buzz.light_blinking = False
-        buzz.light_set(controller, True)
-        time.sleep(0.5)
-
-        while True:
-            button = buzz.get_button_pressed(controller)
-            if button and button != "red":
-                if button == question["correct"]:
-                    print("Controller " + str(controller) + " was correct")
-                    question_answered = True
-                    score[controller] += 1
-                    break
-                elif button.capitalize() in available_answers:
-                    print("Sorry incorrect answer")
-                    available_controllers.remove(controller)
-                    available_answers.remove(button.capitalize())
-                    break
-        buzz.light_set(controller, False)
-    time.sleep(1)
-
-print("Final score")
-print(score)
\ No newline at end of file
+
+# A question file can be given on the command line, otherwise the sample bank is used
+QUESTIONS_FILE = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                     "questions.jsonl")
+QUESTION_COUNT = 10
+# Seconds the player who buzzed in has to answer
+ANSWER_TIME = 10
+# BUZZ_SEED=n deals the same questions and settles ties the same way every time, so a session
+# recorded with BUZZ_RECORD plays out the same when it is replayed (see BuzzLog.py)
+rng = random.Random(os.environ.get("BUZZ_SEED"))
+
+# The built pack (python QuestionPack.py questions.jsonl) is used if it is up to date.
+# Only the questions that are asked get read, their answers are shuffled as each one comes up
+bank = open_questions(QUESTIONS_FILE, rng)
+questions = bank.deal(QUESTION_COUNT)
+
+# BUZZ_METRICS_FILE=path dumps the hot path metrics while the game runs, see Metrics.py
+metrics_dump = Metrics.configure_from_env()
+
+buzz = BuzzManager()
+# The quiz itself is a QuizSession, this file just shows it and lights the controllers
+session = QuizSession(questions, buzz.num_players, rng=rng, answer_timeout_ms=ANSWER_TIME * 1000)
+
+# Scores, answers and buzz-in times are kept in BUZZ_SCORES (scores.db by default, see ScoreStore.py).
+# BUZZ_PLAYERS=Cam,Emily,... names the players in controller order. Only named players are kept,
+# so the store's player list (which simple.py offers on its name screen) doesn't fill up with controllers
+names = [name.strip() for name in os.environ.get("BUZZ_PLAYERS", "").split(",") if name.strip()]
+names = (names + [None] * buzz.num_players)[:buzz.num_players]
+store = ScoreStore(default_path())
+game = store.start_session({i: name for i, name in enumerate(names) if name}, QUESTION_COUNT)
+asked_ns = 0
+reaction_ms = None
+
+
+def report_connection(event):
+    # The game just waits while a dongle is away, the score is kept
+    if event.button == DISCONNECTED:
+        print("Controllers " + str(event.controller) + "-" + str(event.controller + 3) +
+              " disconnected, waiting for them to come back")
+    elif event.button == CONNECTED:
+        print("Controllers " + str(event.controller) + "-" + str(event.controller + 3) + " are back")
+
+
+buzz.add_listener(report_connection)
+
+# Every buzz beeps straight from the event listener, answers get a cue as they are judged
+cues = AudioCues()
+cues.bind(buzz, {"red": "buzz"})
+
+
+def record(outcome, button, correct):
+    if names[outcome.player]:
+        store.record_answer(game, names[outcome.player], outcome.question["id"], button, correct, reaction_ms)
+
+
+def ask(question):
+    global asked_ns
+    print(question["question"])
+    for button in session.available_answers:
+        print(button.capitalize() + " " + question[button])
+    buzz.light_blink(session.available_players)
+    asked_ns = time.monotonic_ns()
+
+
+def show(outcomes):
+    """Print, light up and record what happened. Returns how long to pause before the next question."""
+    global reaction_ms
+    pause = 0
+    for outcome in outcomes:
+        if outcome.kind == QUESTION:
+            ask(outcome.question)
+        elif outcome.kind == BUZZED:
+            result = outcome.detail
+            reaction_ms = max(0, result.events[0].timestamp_ns - asked_ns) / 1e6
+            buzz.light_blink_stop()
+            if len(result.tied) > 1:
+                cues.play("tie")
+                print("Tie between controllers " + ", ".join(str(i) for i in result.tied) +
+                      ", controller " + str(outcome.player) + " wins the tie break")
+            buzz.light_set(outcome.player, True)
+            time.sleep(0.5)
+        elif outcome.kind == CORRECT:
+            print("Controller " + str(outcome.player) + " was correct")
+            cues.play("correct")
+            record(outcome, outcome.detail, True)
+            buzz.light_set(outcome.player, False)
+            pause = 1
+        elif outcome.kind == WRONG:
+            print("Sorry incorrect answer")
+            cues.play("wrong")
+            record(outcome, outcome.detail, False)
+            buzz.light_set(outcome.player, False)
+            if session.phase == BUZZING and session.question is outcome.question:
+                ask(outcome.question)
+        elif outcome.kind == TIMED_OUT:
+            print("Controller " + str(outcome.player) + " ran out of time")
+            cues.play("wrong")
+            record(outcome, None, False)
+            buzz.light_set(outcome.player, False)
+            if session.phase == BUZZING and session.question is outcome.question:
+                ask(outcome.question)
+        elif outcome.kind == SKIPPED:
+            print("Nobody got it, the answer was " + outcome.detail.capitalize())
+            pause = 1
+        elif outcome.kind == FINISHED:
+            print("Final score")
+            print(outcome.detail)
+            # Only the named players are kept, but the win goes to the best score of anybody
+            store.finish_session(game, {names[i]: points for i, points in enumerate(outcome.detail) if names[i]},
+                                 max(outcome.detail))
+    return pause
+
+
+# Presses from as soon as the controllers are open count, which a replayed session relies on
+show(session.start(0))
+paused_until = 0
+while not session.finished:
+    deadline = session.next_deadline_ns()
+    timeout = None if deadline is None else max(0, deadline - time.monotonic_ns()) / 1e9
+    event = buzz.get_event(timeout)
+    if event is None:
+        show(session.on_time())
+        continue
+    if event.pressed and event.timestamp_ns < paused_until:
+        # Pressed while we paused after the last question, that doesn't count for the next one
+        continue
+    pause = show(session.on_event(event))
+    if pause:
+        time.sleep(pause)
+        paused_until = event.timestamp_ns + int(pause * 1e9)
+
+cues.close()
+buzz.close()
+store.close()
+if metrics_dump is not None:
+    metrics_dump.dump()
+    metrics_dump.stop()
@@ -1,15 +1,28 @@
-import pygame
-import threading
 import time
-from BuzzController import BuzzController
 
-pygame.init()
+# Everything in the startup report is timed from here
+STARTED = time.perf_counter()
+
+import concurrent.futures
+import json
+import math
+import os
+import sys
+import threading
+import traceback
+
+import pygame
+
+import Metrics
+
+# Importing this module only sets things up to be started: startup() opens the display,
+# the controllers, the question bank and the sound, at the same time where it can, and
+# main() calls it. Everything below that depends on them is filled in by startup().
 
 # -----------------------------
 # SCREEN & COLOURS
 # -----------------------------
-infoObject = pygame.display.Info()
-WIDTH, HEIGHT = infoObject.current_w, infoObject.current_h
+WIDTH, HEIGHT = 0, 0
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
@@ -18,35 +31,78 @@ RED = (255, 0, 0)
 BLUE = (0, 0, 255)
 YELLOW = (255, 255, 0)
 
-screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.FULLSCREEN)
-pygame.display.set_caption("Quiz Game")
+screen = None
 
 # -----------------------------
 # FONTS
 # -----------------------------
-font_large = pygame.font.Font(None, 74)
-font_small = pygame.font.Font(None, 36)
+font_large = None
+font_small = None
+_font_tiny = None
+
+text_cache = None
+renderer = None
+banner_shown = False
 
 # -----------------------------
-# BUZZ CONTROLLER
+# BUZZ CONTROLLERS
 # -----------------------------
-buzz = BuzzController()
+# Every dongle plugged in, 4 players each. With BUZZ_INPUT_PROCESS=1 the dongles are read
+# in a separate process, so a slow frame here can't delay or reorder the buzz-ins
+buzz = None
+NUM_PLAYERS = 0
+
+# -----------------------------
+# SOUND
+# -----------------------------
+# Decoded up front and played from the controllers' event listener, not from the frame loop
+# (see AudioCues.py for the sound files and BUZZ_AUDIO settings)
+cues = None
+CUES = {"red": "buzz", "blue": "tick", "orange": "tick", "yellow": "tick"}
+
+# -----------------------------
+# METRICS
+# -----------------------------
+# BUZZ_METRICS=1 turns the counters on (BUZZ_METRICS_FILE also dumps them, see Metrics.py),
+# F3 or BUZZ_METRICS_OVERLAY=1 shows them on screen
+metrics_dump = None
+show_metrics = os.environ.get("BUZZ_METRICS_OVERLAY") == "1"
+FRAMES = Metrics.counter("frames")
+FRAME_TIME = Metrics.histogram("frame.render")
+INPUT_LATENCY = Metrics.histogram("input.press_to_handled")
+METRICS_REFRESH = 0.5
+metrics_snapshot = None
+metrics_refreshed = 0.0
+metrics_lines = ()
+
+# -----------------------------
+# QUESTIONS
+# -----------------------------
+# The built pack is used if it is up to date (see QuestionPack.py). Opening either only
+# reads its index, questions are read as they are dealt
+QUESTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "questions.jsonl")
+bank = None
 
 # -----------------------------
 # GAME VARIABLES
 # -----------------------------
 running = True
-ready_players = [False, False, False, False]  # Track which controllers pressed 'red'
-selected_players = [False, False, False, False]
-score = [0, 0, 0, 0]
+ready_players = []  # Track which controllers pressed 'red'
+selected_players = []
+score = []
 
-players_list = sorted([
+# Names come from the score store (see ScoreStore.py), loaded in the background by
+# load_players() so opening it doesn't hold up the first frame. A new store starts with these
+DEFAULT_PLAYERS = [
     "Cam", "Emily", "Oli", "Anna", "David", "Fran",
     "Billy", "Mary", "Iris", "Gran", "James", "Shawn",
     "Kerry", "Guest 1", "Guest 2"
-])
+]
+players_list = []
+players_loaded = threading.Event()
+store = None
 
-selected_player_index = [-1, -1, -1, -1]  # -1 => not yet selected
+selected_player_index = []  # -1 => not yet selected
 used_names = set()
 
 READY_COUNTDOWN_TIME = 5
@@ -54,22 +110,214 @@ countdown_started = False
 countdown_paused = False
 countdown_seconds = READY_COUNTDOWN_TIME
 
-# We'll store the total number of questions here
+# We'll store the total number of questions here (no more than the bank has)
 num_questions = 10
 rounds_selected = False
+questions = None
+
+# The game logic steps at a fixed rate whatever the frame rate is,
+# and button presses reach it as events as soon as the readers see them
+SIM_HZ = 60
+RENDER_FPS = 30
+# Countdowns and other deadlines, run from run_game() so they fire between steps on the game thread
+timers = None
+
+def load_players():
+    """Open the score store and fill players_list from it, on a background thread."""
+    global store
+
+    try:
+        from ScoreStore import ScoreStore, default_path
+
+        store = ScoreStore(default_path())
+        names = store.player_names()
+        if not names:
+            store.add_players(DEFAULT_PLAYERS)
+            names = DEFAULT_PLAYERS
+    except Exception:
+        # Scores can't be kept, but the game still needs someone to be
+        traceback.print_exc()
+        names = DEFAULT_PLAYERS
+    players_list[:] = sorted(names)
+    players_loaded.set()
+
+
+# -----------------------------
+# STARTUP
+# -----------------------------
+
+class StartupReport:
+    """How long each part of startup took, timed from when this module started loading."""
+
+    def __init__(self):
+        self.phases = []    # (name, start, end), seconds from STARTED
+        self.marks = {}     # name -> seconds from STARTED
+        self._lock = threading.Lock()
+
+    def timed(self, name, work, *args):
+        """Run work(*args), recording how long it took under name. Returns what it returns."""
+        start = time.perf_counter() - STARTED
+        try:
+            return work(*args)
+        finally:
+            with self._lock:
+                self.phases.append((name, start, time.perf_counter() - STARTED))
+
+    def mark(self, name):
+        self.marks[name] = time.perf_counter() - STARTED
+
+    def as_dict(self):
+        return {
+            "time": time.time(),
+            "marks_ms": {name: at * 1000 for name, at in self.marks.items()},
+            "phases_ms": [{"name": name, "start": start * 1000, "end": end * 1000, "took": (end - start) * 1000}
+                          for name, start, end in sorted(self.phases, key=lambda phase: phase[1])],
+        }
+
+    def write(self, destination):
+        """Print the report for BUZZ_STARTUP_REPORT=1, otherwise append it as a JSON line to that path."""
+        report = self.as_dict()
+        if destination == "1":
+            for phase in report["phases_ms"]:
+                print("%-14s %8.1f ms -> %8.1f ms  (%.1f ms)" % (phase["name"], phase["start"], phase["end"],
+                                                              phase["took"]), file=sys.stderr)
+            for name, at in sorted(report["marks_ms"].items(), key=lambda mark: mark[1]):
+                print("%-14s %8.1f ms" % (name, at), file=sys.stderr)
+        else:
+            with open(destination, "a") as f:
+                f.write(json.dumps(report) + "\n")
+
+
+startup_report = StartupReport()
+
+
+def font_tiny():
+    """The overlay's font, only loaded once the overlay is first shown."""
+    global _font_tiny
+
+    if _font_tiny is None:
+        _font_tiny = pygame.font.Font(None, 24)
+    return _font_tiny
+
+
+def open_display():
+    global screen, WIDTH, HEIGHT
+
+    pygame.display.init()
+    info = pygame.display.Info()
+    WIDTH, HEIGHT = info.current_w, info.current_h
+    screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.FULLSCREEN)
+    pygame.display.set_caption("Quiz Game")
+
 
-clock = pygame.time.Clock()
+def load_fonts():
+    global font_large, font_small, text_cache, renderer
+    from Renderer import DirtyRenderer, TextCache
 
-# -----------------------------------
-# LIGHT BLINK VARIABLES
-# -----------------------------------
-blink_state = False
-last_blink_time = time.time()
+    pygame.font.init()
+    font_large = pygame.font.Font(None, 74)
+    font_small = pygame.font.Font(None, 36)
+    text_cache = TextCache()
+    renderer = DirtyRenderer(screen)
+
+
+def draw_loading_screen(waiting_for):
+    screen.fill(WHITE)
+    title = font_large.render("Quiz Game", True, BLACK)
+    screen.blit(title, (WIDTH // 2 - title.get_width() // 2, HEIGHT // 2 - 60))
+    if waiting_for:
+        status = font_small.render("Starting " + ", ".join(waiting_for) + "...", True, BLACK)
+        screen.blit(status, (WIDTH // 2 - status.get_width() // 2, HEIGHT // 2 + 20))
+    pygame.display.flip()
+
+
+def open_controllers():
+    if os.environ.get("BUZZ_INPUT_PROCESS") == "1":
+        from BuzzRemote import RemoteBuzz
+        return RemoteBuzz()
+    from BuzzManager import BuzzManager
+    return BuzzManager()
+
+
+def open_bank():
+    from QuestionPack import open_questions
+    return open_questions(QUESTIONS_FILE)
+
+
+def open_sound():
+    from AudioCues import AudioCues
+    return AudioCues()
+
+
+def startup():
+    """
+    Bring the game up. The controllers, question bank and player names are opened on
+    worker threads while this thread opens the display and shows a first frame; the sound
+    (whose tones are made in Python and would slow the first frame down) starts after it.
+    Returns the StartupReport, also written out if BUZZ_STARTUP_REPORT is set.
+    """
+    global buzz, NUM_PLAYERS, cues, bank, metrics_dump, timers, num_questions
+    global ready_players, selected_players, score, selected_player_index
+    from TimerService import TimerService
+
+    report = startup_report
+    report.mark("imported")
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="Startup")
+    tasks = {
+        "controllers": pool.submit(report.timed, "controllers", open_controllers),
+        "questions": pool.submit(report.timed, "questions", open_bank),
+        "names": pool.submit(report.timed, "names", load_players),
+    }
+
+    report.timed("display", open_display)
+    report.timed("fonts", load_fonts)
+    waiting = ["controllers", "questions", "sound"]
+    draw_loading_screen(waiting)
+    report.mark("first_frame")
+    tasks["sound"] = pool.submit(report.timed, "sound", open_sound)
+
+    # Keep the window alive while the rest finish, saying what is still being waited for
+    while True:
+        concurrent.futures.wait([tasks[name] for name in waiting], timeout=0.05)
+        pygame.event.pump()
+        still = [name for name in waiting if not tasks[name].done()]
+        if not still:
+            break
+        if still != waiting:
+            draw_loading_screen(still)
+            waiting = still
+    pool.shutdown(wait=False)
+
+    # Anything that failed (no dongle, say) fails here just as it did when it was opened at import
+    buzz = tasks["controllers"].result()
+    bank = tasks["questions"].result()
+    cues = tasks["sound"].result()
+    cues.bind(buzz, CUES)
+
+    NUM_PLAYERS = buzz.num_players
+    ready_players = [False] * NUM_PLAYERS
+    selected_players = [False] * NUM_PLAYERS
+    score = [0] * NUM_PLAYERS
+    selected_player_index = [-1] * NUM_PLAYERS
+    num_questions = min(num_questions, len(bank))
+    timers = TimerService()
+
+    metrics_dump = Metrics.configure_from_env()
+    if show_metrics:
+        Metrics.enable()
+    report.mark("started")
+    # BUZZ_STARTUP_REPORT=1 prints how long startup took, =path appends it to that file
+    destination = os.environ.get("BUZZ_STARTUP_REPORT")
+    if destination:
+        report.write(destination)
+    return report
 
 
 # -----------------------------
 # LIGHT CONTROL FUNCTIONS
 # -----------------------------
+# The patterns are driven by buzz.lights.tick() from each game loop,
+# so every blinking controller shares one phase.
 
 def update_lights_ready_screen():
     """
@@ -77,17 +325,12 @@ def update_lights_ready_screen():
       - If player i is NOT ready: light ON (steady).
       - If player i IS ready: light BLINK.
     """
-    global blink_state, last_blink_time
-
-    if time.time() - last_blink_time >= 0.5:
-        blink_state = not blink_state
-        last_blink_time = time.time()
-
-    for i in range(4):
+    for i in range(NUM_PLAYERS):
         if not ready_players[i]:
-            buzz.light_set(i, True)      # Not pressed => ON
+            buzz.lights.steady([i], True)      # Not pressed => ON
         else:
-            buzz.light_set(i, blink_state)  # Pressed => BLINK
+            buzz.lights.blink([i])             # Pressed => BLINK
+    buzz.lights.tick()
 
 
 def update_lights_name_selection():
@@ -97,20 +340,15 @@ def update_lights_name_selection():
       - Active but not confirmed => BLINK
       - Active and confirmed => ON
     """
-    global blink_state, last_blink_time
-
-    if time.time() - last_blink_time >= 0.5:
-        blink_state = not blink_state
-        last_blink_time = time.time()
-
-    for i in range(4):
+    for i in range(NUM_PLAYERS):
         if not ready_players[i]:
-            buzz.light_set(i, False)
+            buzz.lights.steady([i], False)
         else:
             if not selected_players[i]:
-                buzz.light_set(i, blink_state)
+                buzz.lights.blink([i])
             else:
-                buzz.light_set(i, True)
+                buzz.lights.steady([i], True)
+    buzz.lights.tick()
 
 
 def update_lights_round_selection():
@@ -119,321 +357,511 @@ def update_lights_round_selection():
       - Inactive players => OFF
       - Active players => BLINK (until round is confirmed)
     """
-    global blink_state, last_blink_time
-
-    if time.time() - last_blink_time >= 0.5:
-        blink_state = not blink_state
-        last_blink_time = time.time()
-
-    for i in range(4):
+    for i in range(NUM_PLAYERS):
         if not ready_players[i]:
-            buzz.light_set(i, False)
+            buzz.lights.steady([i], False)
         else:
             # All active controllers blink until a red press finalises the selection
-            buzz.light_set(i, blink_state)
+            buzz.lights.blink([i])
+    buzz.lights.tick()
 
 
 # -----------------------------
 # DRAW FUNCTIONS
 # -----------------------------
+# Each screen is split into regions that are only redrawn when their state changes,
+# and only those rectangles are sent to the display (see Renderer.DirtyRenderer).
+
+def blit_text(text, font, colour, centre_x, y):
+    """Blit cached text centred on centre_x."""
+    surface = text_cache.render(font, text, colour)
+    screen.blit(surface, (centre_x - surface.get_width() // 2, y))
+
 
 def draw_ready_screen():
     """Draws the screen showing which players have pressed the red buzzer and a countdown if started."""
-    screen.fill(WHITE)
+    renderer.begin("ready", WHITE)
 
     # Title
-    title_text = font_large.render("Press Red to Get Ready!", True, BLACK)
-    screen.blit(title_text, (WIDTH // 2 - title_text.get_width() // 2, 20))
-
-    # Draw sections for each player
-    section_width = WIDTH // 4
-    for i in range(4):
-        colour = GREEN if ready_players[i] else RED
-        pygame.draw.rect(screen, colour, (i * section_width, 100, section_width, HEIGHT - 100))
-        label = font_small.render(f"Player {i + 1}", True, BLACK)
-        screen.blit(label, (i * section_width + (section_width // 2 - label.get_width() // 2),
-                            HEIGHT // 2))
-
-    # If countdown has started, display it
+    def draw_title(rect):
+        screen.fill(WHITE, rect)
+        blit_text("Press Red to Get Ready!", font_large, BLACK, WIDTH // 2, 20)
+    renderer.region("title", (0, 0, WIDTH, 100), None, draw_title)
+
+    # Draw sections for each player, leaving a strip at the bottom for the countdown
+    section_width = WIDTH // NUM_PLAYERS
+    for i in range(NUM_PLAYERS):
+        def draw_player(rect, i=i):
+            screen.fill(GREEN if ready_players[i] else RED, rect)
+            blit_text(f"Player {i + 1}", font_small, BLACK, rect.centerx, HEIGHT // 2)
+        renderer.region(("player", i), (i * section_width, 100, section_width, HEIGHT - 160),
+                        ready_players[i], draw_player)
+
+    # If countdown has started, display it over the bottom of the player sections
+    countdown = None
     if countdown_started and not countdown_paused:
-        countdown_text = font_small.render(f"Countdown: {countdown_seconds} sec", True, BLACK)
-        screen.blit(countdown_text, (WIDTH // 2 - countdown_text.get_width() // 2, HEIGHT - 50))
+        countdown = f"Countdown: {countdown_seconds} sec"
+
+    def draw_countdown(rect):
+        for i in range(NUM_PLAYERS):
+            screen.fill(GREEN if ready_players[i] else RED, (i * section_width, rect.y, section_width, rect.height))
+        if countdown:
+            blit_text(countdown, font_small, BLACK, WIDTH // 2, HEIGHT - 50)
+    renderer.region("countdown", (0, HEIGHT - 60, WIDTH, 60), (tuple(ready_players), countdown), draw_countdown)
 
 
 def draw_name_selection():
     """Draws the name-selection screen, split for each active player."""
     active_players = sum(ready_players) or 1
-    screen.fill(WHITE)
+    renderer.begin("names", WHITE)
 
     # Title
-    title_text = font_large.render("Select Your Name", True, BLACK)
-    screen.blit(title_text, (WIDTH // 2 - title_text.get_width() // 2, 20))
+    def draw_title(rect):
+        screen.fill(WHITE, rect)
+        blit_text("Select Your Name", font_large, BLACK, WIDTH // 2, 20)
+    renderer.region("title", (0, 0, WIDTH, 100), None, draw_title)
 
     section_width = WIDTH // active_players
+    y_offset = 100
+    # The help text has the bottom strip to itself
+    bottom = HEIGHT - 40
 
     player_slot = 0
-    for i in range(4):
+    for i in range(NUM_PLAYERS):
         if not ready_players[i]:
             continue
 
         x_offset = player_slot * section_width
-        y_offset = 100
         player_slot += 1
 
-        if selected_players[i]:
-            # Player has finalised their choice
-            pygame.draw.rect(screen, GREEN, (x_offset, y_offset, section_width, HEIGHT - y_offset))
-            chosen_name_text = font_large.render(players_list[selected_player_index[i]], True, BLACK)
-            screen.blit(chosen_name_text, (x_offset + (section_width // 2 - chosen_name_text.get_width() // 2),
-                                           HEIGHT // 2 - 50))
-            ready_text = font_small.render("is Ready to Play!", True, BLACK)
-            screen.blit(ready_text, (x_offset + (section_width // 2 - ready_text.get_width() // 2),
-                                     HEIGHT // 2 + 10))
-
-            instruction = font_small.render("Press Yellow to Reselect", True, BLACK)
-            screen.blit(instruction, (x_offset + (section_width // 2 - instruction.get_width() // 2),
-                                      HEIGHT - 70))
-        else:
-            # Not finalised
-            pygame.draw.rect(screen, WHITE, (x_offset, y_offset, section_width, HEIGHT - y_offset))
-            for index, name in enumerate(players_list):
-                if index == selected_player_index[i]:
-                    bg_colour = YELLOW
-                else:
-                    bg_colour = WHITE
-
-                rect_y = y_offset + (index * 30)
-                if rect_y + 30 < HEIGHT:
-                    pygame.draw.rect(screen, bg_colour, (x_offset, rect_y, section_width, 30))
+        def draw_player(rect, i=i):
+            if selected_players[i]:
+                # Player has finalised their choice
+                screen.fill(GREEN, rect)
+                blit_text(players_list[selected_player_index[i]], font_large, BLACK, rect.centerx, HEIGHT // 2 - 50)
+                blit_text("is Ready to Play!", font_small, BLACK, rect.centerx, HEIGHT // 2 + 10)
+                blit_text("Press Yellow to Reselect", font_small, BLACK, rect.centerx, HEIGHT - 70)
+            elif not players_loaded.is_set():
+                screen.fill(WHITE, rect)
+                blit_text("Loading names...", font_small, BLACK, rect.centerx, y_offset)
+            else:
+                # Not finalised
+                screen.fill(WHITE, rect)
+                for index, name in enumerate(players_list):
+                    rect_y = y_offset + (index * 30)
+                    if rect_y + 30 >= bottom:
+                        break
+                    if index == selected_player_index[i]:
+                        screen.fill(YELLOW, (rect.x, rect_y, rect.width, 30))
 
                     # If name is taken by someone else, show in RED
                     if name in used_names and index != selected_player_index[i]:
                         name_colour = RED
                     else:
                         name_colour = BLACK
+                    blit_text(name, font_small, name_colour, rect.centerx, rect_y)
 
-                    name_text = font_small.render(name, True, name_colour)
-                    screen.blit(name_text, (x_offset + (section_width // 2 - name_text.get_width() // 2),
-                                            rect_y))
+        # Names taken by others only matter while this player is still choosing
+        taken = None if selected_players[i] else frozenset(used_names)
+        state = (selected_players[i], selected_player_index[i], taken, players_loaded.is_set())
+        renderer.region(("player", i), (x_offset, y_offset, section_width, bottom - y_offset), state, draw_player)
 
-    help_text = font_small.render("Use Blue for Up, Orange for Down, Red to Select, Yellow to Reselect", True, BLACK)
-    screen.blit(help_text, (WIDTH // 2 - help_text.get_width() // 2, HEIGHT - 30))
+    def draw_help(rect):
+        screen.fill(WHITE, rect)
+        blit_text("Use Blue for Up, Orange for Down, Red to Select, Yellow to Reselect",
+                  font_small, BLACK, WIDTH // 2, HEIGHT - 30)
+    renderer.region("help", (0, bottom, WIDTH, HEIGHT - bottom), None, draw_help)
 
 
 def draw_round_selection(num_questions):
     """Draw a screen that asks how many questions in total."""
-    screen.fill(WHITE)
-
-    prompt_text = font_large.render("How many questions in total?", True, BLACK)
-    screen.blit(prompt_text, (WIDTH // 2 - prompt_text.get_width() // 2, HEIGHT // 2 - 100))
-
-    number_text = font_large.render(str(num_questions), True, BLACK)
-    screen.blit(number_text, (WIDTH // 2 - number_text.get_width() // 2, HEIGHT // 2 - 20))
-
-    help_text = font_small.render("Use Blue (Up), Orange (Down), Red to Confirm", True, BLACK)
-    screen.blit(help_text, (WIDTH // 2 - help_text.get_width() // 2, HEIGHT - 60))
+    renderer.begin("rounds", WHITE)
+
+    def draw_prompt(rect):
+        screen.fill(WHITE, rect)
+        blit_text("How many questions in total?", font_large, BLACK, WIDTH // 2, HEIGHT // 2 - 100)
+    renderer.region("prompt", (0, HEIGHT // 2 - 100, WIDTH, 70), None, draw_prompt)
+
+    def draw_number(rect):
+        screen.fill(WHITE, rect)
+        blit_text(str(num_questions), font_large, BLACK, WIDTH // 2, HEIGHT // 2 - 20)
+    renderer.region("number", (0, HEIGHT // 2 - 20, WIDTH, 70), num_questions, draw_number)
+
+    def draw_help(rect):
+        screen.fill(WHITE, rect)
+        blit_text("Use Blue (Up), Orange (Down), Red to Confirm", font_small, BLACK, WIDTH // 2, HEIGHT - 60)
+    renderer.region("help", (0, HEIGHT - 60, WIDTH, 40), None, draw_help)
+
+
+def draw_connection_banner():
+    """If a dongle has gone away, say so over whatever screen is up (the game waits for it)."""
+    global banner_shown
+
+    if buzz.connected:
+        if banner_shown:
+            # Repaint whatever the banner was covering
+            banner_shown = False
+            renderer.invalidate()
+        return
+
+    banner_shown = True
+    players = buzz.disconnected_players()
+
+    def draw_banner(rect):
+        screen.fill(RED, rect)
+        banner = text_cache.render(font_small, f"Controllers for players {players[0] + 1}-{players[-1] + 1} "
+                                   "disconnected, plug them back in to carry on", WHITE)
+        screen.blit(banner, (WIDTH // 2 - banner.get_width() // 2, HEIGHT // 2 - banner.get_height() // 2))
+    # Redrawn every frame, anything repainted underneath would otherwise cover it
+    renderer.region("banner", (0, HEIGHT // 2 - 30, WIDTH, 60), renderer.frames, draw_banner)
+
+
+def metrics_overlay_lines(snap):
+    """The overlay's text for a snapshot taken against the one before it."""
+    counters = snap["counters"]
+    histograms = snap["histograms"]
+
+    def rate(name):
+        return counters.get(name, {}).get("per_sec", 0.0)
+
+    def timing(name):
+        h = histograms.get(name)
+        if not h or not h["count"]:
+            return "-"
+        return f"{h['p50_ms']:.2f} / {h['p99_ms']:.2f} ms"
+
+    depth = snap["gauges"].get("events.queue_depth", {"value": 0, "peak": 0})
+    coalescing = Metrics.ratio(snap, "led.commits", "hid.writes")
+    return (
+        f"HID reads {rate('hid.reads'):.0f}/s, writes {rate('hid.writes'):.1f}/s",
+        f"Report decode p50/p99 {timing('report.decode')}",
+        f"Event queue {depth['value']} (peak {depth['peak']})",
+        f"Press to handled {timing('input.press_to_handled')}",
+        f"Press to buzz-in decision {timing('buzz_in.press_to_decision')}",
+        f"Frame {timing('frame.render')}, {rate('frames'):.0f} fps",
+        "LED commits per write " + ("-" if coalescing is None else f"{coalescing:.1f}"),
+    )
+
+
+def draw_metrics_overlay():
+    """The live metrics in the top left corner, refreshed twice a second."""
+    global metrics_snapshot, metrics_refreshed, metrics_lines
+
+    if not show_metrics:
+        return
+    now = time.monotonic()
+    if now - metrics_refreshed >= METRICS_REFRESH:
+        snap = Metrics.snapshot(metrics_snapshot)
+        if metrics_snapshot is not None:
+            metrics_lines = metrics_overlay_lines(snap)
+        metrics_snapshot = snap
+        metrics_refreshed = now
+
+    def draw_panel(rect):
+        screen.fill(BLACK, rect)
+        for n, line in enumerate(metrics_lines):
+            screen.blit(text_cache.render(font_tiny(), line, WHITE), (rect.x + 10, rect.y + 8 + n * 22))
+    # Redrawn every frame, like the banner, so regions repainted underneath don't cover it
+    renderer.region("metrics", (0, 0, 420, 16 + 22 * max(1, len(metrics_lines))), renderer.frames, draw_panel)
 
 
 # -----------------------------
-# HELPER FUNCTIONS
+# GAME STATES
 # -----------------------------
+# Each screen is a state: the loop in run_game() hands it every button press as it happens,
+# steps it at SIM_HZ and draws it at RENDER_FPS. update() returns the next state, itself,
+# or None when the game setup is finished.
 
-def wait_for_buzzer_release():
-    """
-    Ensure all buzzers are released before proceeding,
-    so we don't instantly trigger any button checks from a prior press.
-    """
-    while True:
-        all_released = True
-        for i in range(4):
-            buttons = buzz.get_button_status()[i]
-            if any(buttons.values()):
-                all_released = False
-                break
-        if all_released:
-            break
-        time.sleep(0.1)
+class GameState:
+    def enter(self):
+        pass
 
+    def on_press(self, player, button):
+        pass
 
-def start_countdown():
-    """
-    Start the countdown in a separate thread.
-    Break early if all 4 players become ready.
-    """
-    global countdown_seconds, countdown_started, countdown_paused
-    countdown_started = True
-    while countdown_seconds > 0:
-        if all(ready_players):
-            countdown_paused = True
-            break
-        countdown_seconds -= 1
-        time.sleep(1)
+    def update(self, dt):
+        return self
+
+    def update_lights(self):
+        pass
+
+    def draw(self):
+        pass
 
 
-def handle_ready_screen():
+class ReadyState(GameState):
     """Players press red to indicate readiness; at least 2 needed to move on."""
-    global running
 
-    countdown_thread = None
+    def enter(self):
+        self.countdown = None
+        self.countdown_over = False
 
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
+    def on_press(self, player, button):
+        if button == "red":
+            ready_players[player] = True
 
-        # Check for red presses
-        for i in range(4):
-            if not ready_players[i]:
-                button = buzz.get_button_pressed(i)
-                if button == "red":
-                    ready_players[i] = True
+    def update(self, dt):
+        global countdown_seconds, countdown_started, countdown_paused
 
-        # If 2+ ready and countdown not started, launch countdown
+        # If 2+ ready, start the countdown
         if sum(ready_players) >= 2 and not countdown_started:
-            countdown_thread = threading.Thread(target=start_countdown, daemon=True)
-            countdown_thread.start()
+            countdown_started = True
+            self.countdown = timers.call_later(READY_COUNTDOWN_TIME, self.end_countdown)
 
         # If all ready, skip countdown
         if all(ready_players) and countdown_started:
-            break
+            countdown_paused = True
+            self.countdown.cancel()
+            return NameSelectionState()
+
+        if countdown_started:
+            # Hold the countdown while a dongle is unplugged
+            if buzz.connected:
+                self.countdown.resume()
+            else:
+                self.countdown.pause()
+            countdown_seconds = max(0, math.ceil(self.countdown.remaining()))
 
-        # If countdown ended and we have at least 2 players, move on
-        if countdown_started and not countdown_paused and countdown_seconds <= 0:
-            if sum(ready_players) >= 2:
-                break
+            # If countdown ended and we have at least 2 players, move on
+            if self.countdown_over:
+                return NameSelectionState()
+        return self
 
-        # Update lights
+    def end_countdown(self):
+        self.countdown_over = True
+
+    def update_lights(self):
         update_lights_ready_screen()
 
-        # Draw screen
+    def draw(self):
         draw_ready_screen()
-        pygame.display.flip()
-        clock.tick(30)
 
 
-def handle_name_selection():
+class NameSelectionState(GameState):
     """Active players choose a name (blue/orange = up/down, red = confirm, yellow = reset)."""
-    global selected_player_index, selected_players, used_names
 
-    for i in range(4):
-        if ready_players[i]:
-            selected_player_index[i] = 0
-
-    while True:
-        if all((not ready_players[i]) or selected_players[i] for i in range(4)):
-            break
+    def enter(self):
+        self.names_shown = False
 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
+    def show_names(self):
+        self.names_shown = True
+        for i in range(NUM_PLAYERS):
+            if ready_players[i]:
+                selected_player_index[i] = 0
+
+    def step_name(self, i, step):
+        # On to the next name nobody has taken. There can be more players than names, so once
+        # every name is taken it stays put (and red won't confirm a taken name)
+        index = selected_player_index[i]
+        for _ in range(len(players_list)):
+            index = (index + step) % len(players_list)
+            if players_list[index] not in used_names:
+                selected_player_index[i] = index
                 return
 
-        for i in range(4):
-            if not ready_players[i]:
-                continue
+    def on_press(self, i, button):
+        if not ready_players[i] or not self.names_shown:
+            return
 
-            button = buzz.get_button_pressed(i)
-            if selected_players[i]:
-                # If already confirmed name
-                if button == "yellow":
-                    # Reselect
-                    if selected_player_index[i] != -1 and players_list[selected_player_index[i]] in used_names:
-                        used_names.discard(players_list[selected_player_index[i]])
-                    selected_player_index[i] = 0
-                    selected_players[i] = False
-            else:
-                # Not confirmed name yet
-                if button == "blue":
-                    selected_player_index[i] = (selected_player_index[i] - 1) % len(players_list)
-                    while players_list[selected_player_index[i]] in used_names:
-                        selected_player_index[i] = (selected_player_index[i] - 1) % len(players_list)
-
-                elif button == "orange":
-                    selected_player_index[i] = (selected_player_index[i] + 1) % len(players_list)
-                    while players_list[selected_player_index[i]] in used_names:
-                        selected_player_index[i] = (selected_player_index[i] + 1) % len(players_list)
-
-                elif button == "red":
-                    chosen_name = players_list[selected_player_index[i]]
-                    if chosen_name not in used_names:
-                        used_names.add(chosen_name)
-                        selected_players[i] = True
-
-                elif button == "yellow":
-                    # Reset
-                    if players_list[selected_player_index[i]] in used_names:
-                        used_names.discard(players_list[selected_player_index[i]])
-                    selected_player_index[i] = 0
-                    selected_players[i] = False
-
-        # Update lights
+        if selected_players[i]:
+            # If already confirmed name
+            if button == "yellow":
+                # Reselect
+                if selected_player_index[i] != -1 and players_list[selected_player_index[i]] in used_names:
+                    used_names.discard(players_list[selected_player_index[i]])
+                selected_player_index[i] = 0
+                selected_players[i] = False
+        else:
+            # Not confirmed name yet
+            if button == "blue":
+                self.step_name(i, -1)
+
+            elif button == "orange":
+                self.step_name(i, 1)
+
+            elif button == "red":
+                chosen_name = players_list[selected_player_index[i]]
+                if chosen_name not in used_names:
+                    used_names.add(chosen_name)
+                    selected_players[i] = True
+
+            elif button == "yellow":
+                # Reset
+                if players_list[selected_player_index[i]] in used_names:
+                    used_names.discard(players_list[selected_player_index[i]])
+                selected_player_index[i] = 0
+                selected_players[i] = False
+
+    def update(self, dt):
+        if not self.names_shown:
+            # Still waiting on load_players()
+            if players_loaded.is_set():
+                self.show_names()
+            return self
+        if all((not ready_players[i]) or selected_players[i] for i in range(NUM_PLAYERS)):
+            return RoundSelectionState()
+        return self
+
+    def update_lights(self):
         update_lights_name_selection()
 
-        # Draw
+    def draw(self):
         draw_name_selection()
-        pygame.display.flip()
-        clock.tick(30)
 
 
-def handle_round_selection():
+class RoundSelectionState(GameState):
     """
     Let all active (ready) players change the total number of questions.
     Blue => increment
     Orange => decrement
     Red => confirm (by any active player)
     """
-    global num_questions, rounds_selected
 
-    while not rounds_selected:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                return
+    def on_press(self, player, button):
+        global num_questions, rounds_selected
 
-        # Check each active player's button presses
-        for i in range(4):
-            if ready_players[i]:
-                button = buzz.get_button_pressed(i)
-                if button == "blue":
-                    num_questions += 1
-                    # Optional: limit or wrap
-                elif button == "orange":
-                    num_questions = max(1, num_questions - 1)  # never go below 1
-                elif button == "red":
-                    # Confirm selection
-                    rounds_selected = True
-                    break
+        if not ready_players[player] or rounds_selected:
+            return
+        if button == "blue":
+            num_questions = min(len(bank), num_questions + 1)
+        elif button == "orange":
+            num_questions = max(1, num_questions - 1)  # never go below 1
+        elif button == "red":
+            # Confirm selection
+            rounds_selected = True
 
-        # Update lights (active players blink)
+    def update(self, dt):
+        return None if rounds_selected else self
+
+    def update_lights(self):
+        # Active players blink
         update_lights_round_selection()
 
-        # Draw screen
+    def draw(self):
         draw_round_selection(num_questions)
-        pygame.display.flip()
-        clock.tick(30)
 
 
-# -----------------------------
-# MAIN
-# -----------------------------
-def main():
-    handle_ready_screen()
-    wait_for_buzzer_release()
+def toggle_metrics_overlay():
+    global show_metrics
 
-    handle_name_selection()
-    wait_for_buzzer_release()
+    show_metrics = not show_metrics
+    if show_metrics:
+        Metrics.enable()
+    else:
+        # Repaint whatever it was covering
+        renderer.invalidate()
 
-    # Now handle round selection
-    handle_round_selection()
-    wait_for_buzzer_release()
 
-    # Done - just a demonstration end screen
-    screen.fill(WHITE)
-    final_message = font_large.render(f"All Players Ready! {num_questions} Questions", True, BLACK)
-    screen.blit(final_message, (WIDTH // 2 - final_message.get_width() // 2, HEIGHT // 2))
-    pygame.display.flip()
-    time.sleep(3)
+def run_game(state):
+    """
+    Run the state machine from state until it finishes or the window is closed.
+    Presses are taken from the event stream in the order they happened, so a tap shorter
+    than a frame still counts and a slow frame only delays the picture, not the input.
+    """
+    global running
+
+    step = 1.0 / SIM_HZ
+    frame = 1.0 / RENDER_FPS
+    state.enter()
+
+    last = time.monotonic()
+    next_frame = last
+    accumulator = 0.0
+    pending = []
+
+    while running and state is not None:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                toggle_metrics_overlay()
+
+        # Input: every press since the last pass
+        pending.extend(buzz.drain_events())
+        for event in pending:
+            if event.pressed:
+                state.on_press(event.controller, event.button)
+                if Metrics.ENABLED:
+                    INPUT_LATENCY.record(time.monotonic_ns() - event.timestamp_ns)
+        pending = []
+        timers.run_due()
+
+        # Simulation: fixed steps for however much time has gone by (capped, so a stall doesn't snowball)
+        now = time.monotonic()
+        accumulator = min(accumulator + now - last, 0.25)
+        last = now
+        while accumulator >= step:
+            accumulator -= step
+            next_state = state.update(step)
+            if next_state is not state:
+                # Presses meant for the old screen don't carry over
+                buzz.drain_events()
+                state = next_state
+                if state is None:
+                    break
+                state.enter()
+        if state is None:
+            break
+
+        # Rendering: at its own rate, regions that haven't changed aren't redrawn
+        if now >= next_frame:
+            start = time.perf_counter_ns()
+            state.update_lights()
+            state.draw()
+            drawn = time.perf_counter_ns()
+            draw_connection_banner()
+            draw_metrics_overlay()
+            renderer.present()
+            next_frame = max(next_frame + frame, now)
+            if Metrics.ENABLED:
+                Metrics.histogram("draw." + type(state).__name__).record(drawn - start)
+                FRAME_TIME.record(time.perf_counter_ns() - start)
+                FRAMES.add()
+
+        # Sleep until the next step, frame or timer is due, but wake up as soon as a button is pressed
+        timeout = timers.next_delay(min(step - accumulator, next_frame - time.monotonic()))
+        event = buzz.get_event(max(0.0, timeout))
+        if event is not None:
+            pending.append(event)
 
+
+# -----------------------------
+# MAIN
+# -----------------------------
+def main():
+    global questions
+
+    startup()
+    run_game(ReadyState())
+
+    if running:
+        # The quiz isn't played here yet, so the game is recorded with its players and no answers
+        if store is not None:
+            store.start_session({i: players_list[selected_player_index[i]] for i in range(NUM_PLAYERS)
+                                 if selected_players[i]}, num_questions)
+
+        # Pick the questions; each is only read from the bank when it comes up
+        questions = bank.deal(num_questions)
+        first = next(questions, None)
+
+        # Done - just a demonstration end screen
+        screen.fill(WHITE)
+        final_message = font_large.render(f"All Players Ready! {num_questions} Questions", True, BLACK)
+        screen.blit(final_message, (WIDTH // 2 - final_message.get_width() // 2, HEIGHT // 2))
+        if first is not None:
+            first_message = font_small.render(f"First up: {first['category']}", True, BLACK)
+            screen.blit(first_message, (WIDTH // 2 - first_message.get_width() // 2, HEIGHT // 2 + 80))
+        pygame.display.flip()
+        time.sleep(3)
+
+    bank.close()
+    cues.close()
+    buzz.close()
+    players_loaded.wait()
+    if store is not None:
+        store.close()
+    if metrics_dump is not None:
+        metrics_dump.stop()
     pygame.quit()
 
 